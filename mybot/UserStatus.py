@@ -1,8 +1,15 @@
-class UserStatus:
-    COUPLED = "coupled"
-    IDLE = "idle"
-    IN_SEARCH = "in_search"
-    PARTNER_LEFT = "partner_left"
-    CHAT_WITH_AI = "chat_with_ai"
-
-    possible_states = [COUPLED, IDLE, IN_SEARCH, PARTNER_LEFT, CHAT_WITH_AI]
+class UserStatus:
+    COUPLED = "coupled"
+    IDLE = "idle"
+    IN_SEARCH = "in_search"
+    PARTNER_LEFT = "partner_left"
+    CHAT_WITH_AI = "chat_with_ai"
+
+    possible_states = [COUPLED, IDLE, IN_SEARCH, PARTNER_LEFT, CHAT_WITH_AI]
+
+    # Через сколько секунд без сообщений от пользователя сессия завершается (см. reaper.py).
+    # Статусы без таймаута не отслеживаются
+    timeouts = {
+        IN_SEARCH: 15 * 60,
+        COUPLED: 60 * 60,
+    }
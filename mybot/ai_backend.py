@@ -0,0 +1,86 @@
+"""
+Подключаемый бэкенд чата с ИИ.
+Бэкенд - класс с методами start(), close() и корутиной detect_intent(user_id, text, language_code),
+которая возвращает ответ (строку или Reply) или None. Класс задается в config.AI_BACKEND строкой "модуль.Класс"
+и загружается при первом входе в чат с ИИ, поэтому gRPC и protobuf не замедляют запуск бота.
+"""
+import asyncio
+import importlib
+import logging
+import time
+from config import AI_BACKEND
+import metrics
+
+
+class Reply(str):
+    """Текст ответа бэкенда; cacheable=False - ответ зависит от контекста диалога или параметров."""
+
+    def __new__(cls, text, cacheable=True):
+        reply = super().__new__(cls, text)
+        reply.cacheable = cacheable
+        return reply
+
+
+class LazyBackend:
+    """
+    Загружает бэкенд в фоновом потоке при первом обращении (импорт модуля, чтение учетных данных
+    и открытие канала не блокируют цикл событий). Запросы, пришедшие во время загрузки, ждут ее;
+    если загрузка не удалась, следующий запрос пробует снова.
+    """
+
+    def __init__(self, path=AI_BACKEND):
+        self.path = path
+        self._backend = None
+        self._loading = None  # задача загрузки
+
+    @property
+    def loaded(self):
+        return self._backend is not None
+
+    def preload(self):
+        """Начинает загрузку в фоне, не дожидаясь ее (вызывается при входе в чат с ИИ)."""
+        if self._backend is None and self._loading is None:
+            self._loading = asyncio.create_task(self._load())
+
+    def _create(self):
+        module_name, class_name = self.path.rsplit(".", 1)
+        backend = getattr(importlib.import_module(module_name), class_name)()
+        backend.start()
+        return backend
+
+    async def _load(self):
+        started = time.perf_counter()
+        try:
+            backend = await asyncio.get_running_loop().run_in_executor(None, self._create)
+        except Exception as e:
+            logging.error("Не удалось загрузить бэкенд ИИ %s: %s", self.path, e)
+            return None
+        finally:
+            self._loading = None
+        elapsed = time.perf_counter() - started
+        metrics.registry.histogram("bot_ai_backend_load_seconds").observe(elapsed)
+        logging.warning("Бэкенд ИИ %s загружен за %.2f с.", self.path, elapsed)
+        self._backend = backend
+        return backend
+
+    async def detect_intent(self, user_id, text, language_code="ru"):
+        """Передает запрос бэкенду, загружая его при необходимости. None - бэкенд недоступен."""
+        backend = self._backend
+        if backend is None:
+            self.preload()
+            # shield: отмена одного запроса не прерывает загрузку для остальных
+            backend = await asyncio.shield(self._loading) if self._loading is not None else self._backend
+            if backend is None:
+                return None
+        return await backend.detect_intent(user_id, text, language_code)
+
+    def close(self):
+        if self._loading is not None:
+            self._loading.cancel()
+            self._loading = None
+        if self._backend is not None:
+            self._backend.close()
+            self._backend = None
+
+
+ai_backend = LazyBackend()
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from google.cloud import dialogflow
+from ai_backend import Reply
+import metrics
+from config import (DIALOGFLOW_CREDENTIALS, PROJECT_ID, DIALOGFLOW_ENDPOINT, AI_MAX_CONCURRENCY,
+                    AI_REQUEST_TIMEOUT)
+
+
+class DialogflowClient:
+    """
+    Общий клиент Dialogflow - бэкенд чата с ИИ по умолчанию (см. ai_backend.py).
+    Создается при первом входе в чат с ИИ; файл учетных данных читается и канал gRPC
+    открывается только в start().
+    Блокирующий detect_intent выполняется в ограниченном пуле потоков, число одновременных
+    запросов ограничено, а у каждого запроса есть таймаут, поэтому медленный ответ Google
+    не задерживает обработку обновлений остальных пользователей.
+    """
+
+    def __init__(self, credentials_file=DIALOGFLOW_CREDENTIALS, project_id=PROJECT_ID,
+                 endpoint=DIALOGFLOW_ENDPOINT, max_concurrency=AI_MAX_CONCURRENCY,
+                 timeout=AI_REQUEST_TIMEOUT):
+        self.credentials_file = credentials_file
+        self.project_id = project_id
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._client = None
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="dialogflow")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def start(self):
+        """Создает клиент и канал gRPC."""
+        if self._client is not None:
+            return
+        if self.endpoint:
+            # Локальный (тестовый) сервер: канал без TLS и без учетных данных
+            import grpc
+            from google.auth.credentials import AnonymousCredentials
+            from google.cloud.dialogflow_v2.services.sessions.transports import SessionsGrpcTransport
+            transport = SessionsGrpcTransport(channel=grpc.insecure_channel(self.endpoint),
+                                              credentials=AnonymousCredentials())
+            self._client = dialogflow.SessionsClient(transport=transport)
+        else:
+            self._client = dialogflow.SessionsClient.from_service_account_json(self.credentials_file)
+
+    def close(self):
+        """Закрывает канал gRPC и пул потоков."""
+        if self._client is not None:
+            self._client.transport.close()
+            self._client = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _detect_intent(self, user_id, text, language_code):
+        session = self._client.session_path(self.project_id, user_id)
+        text_input = dialogflow.TextInput(text=text, language_code=language_code)
+        query_input = dialogflow.QueryInput(text=text_input)
+        response = self._client.detect_intent(session=session, query_input=query_input, timeout=self.timeout)
+        result = response.query_result
+        # Ответ с контекстами или извлеченными параметрами относится к диалогу этого пользователя
+        return Reply(result.fulfillment_text, cacheable=not result.output_contexts and not result.parameters)
+
+    async def detect_intent(self, user_id, text, language_code="ru"):
+        """
+        Отправляет сообщение пользователя в Dialogflow
+        :param user_id: ID пользователя (используется как ID сессии Dialogflow)
+        :param text: текст сообщения
+        :param language_code: язык запроса
+        :return: ответ Dialogflow (Reply) или None, если запрос не удался или превысил таймаут
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            async with self._semaphore:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(self._executor, self._detect_intent, user_id, text, language_code),
+                    timeout=self.timeout)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            logging.warning("Dialogflow не ответил за %s с (пользователь %s).", self.timeout, user_id)
+        except Exception as e:
+            outcome = "error"
+            logging.error("Ошибка при запросе к Dialogflow: %s", e)
+        finally:
+            metrics.registry.histogram("bot_ai_request_seconds", outcome=outcome).observe(
+                time.perf_counter() - started)
+        return None
@@ -1,364 +1,641 @@
-import logging
-from telegram import Update, ChatMember
-from telegram.ext import (filters, ApplicationBuilder, ContextTypes, CommandHandler, ConversationHandler,
-                          MessageHandler, ChatMemberHandler)
-from UserStatus import UserStatus
-from config import BOT_TOKEN, ADMIN_ID, PROJECT_ID, DIALOGFLOW_CREDENTIALS
-import db_connection
-from google.cloud import dialogflow
-
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.WARNING  # Установить уровень логирования: (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-)
-
-"""
-####### Список команд #######
----> start -  запускает бота
----> help -  вывод списка команд
----> chat - начать поиск собеседника
----> exit -  выйти из чата
----> chat_AI -  начать чат с ИИ
----> exit_AI -  завершить чат с ИИ
----> stats -  показать статистику бота (только для администратора)
-"""
-
-
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """
-    Приветствует пользователя и устанавливает его статус в "ожидании", если он/она еще не в базе данных
-    :param update: обновление, полученное от пользователя
-    :param context: контекст бота
-    :return: статус USER_ACTION
-    """
-    await context.bot.send_message(chat_id=update.effective_chat.id,
-                                   text="Добро пожаловать в этот ChatBot! Я создан для анонимного общения или простого диалога с ИИ. 🤖\nНапишите /help, чтобы увидеть список моих возможностей.")
-
-    # Добавить пользователя в базу данных, если его там еще нет (проверка выполняется в функции)
-    user_id = update.effective_user.id
-    db_connection.insert_user(user_id)
-
-    return USER_ACTION
-
-async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Обрабатывает команду /help, отправляя список доступных команд
-    """
-    help_text = (
-        "🛠️ Доступные команды:\n\n"
-        "👤 Основные команды:\n"
-        "/start - Запустить бота\n"
-        "/help - Показать это сообщение\n"
-        "/chat - Найти собеседника\n"
-        "/exit - Завершить текущий чат\n\n"
-        "🤖 Команды для работы с ИИ:\n"
-        "/chat_AI - Начать чат с ИИ\n"
-        "/exit_AI - Завершить чат с ИИ\n\n"
-        "📊 Админ-команды:\n"
-        "/stats - Показать статистику бота (только для администратора)\n"
-    )
-    await update.message.reply_text(help_text)
-
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = update.effective_user.id
-    user_status = db_connection.get_user_status(user_id)
-    logging.debug(f"Получено сообщение от {user_id}, статус: {user_status}")
-
-    if user_status == UserStatus.COUPLED:
-        # Найти ID партнёра
-        other_user_id = db_connection.get_partner_id(user_id)
-        logging.debug(f"ID партнёра для {user_id}: {other_user_id}")
-        if other_user_id:
-            await in_chat(update, other_user_id)
-        else:
-            logging.warning(f"Партнёр для пользователя {user_id} не найден!")
-    else:
-        await context.bot.send_message(chat_id=user_id, text="🤖 Вы не находитесь в чате.")
-
-
-async def handle_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Обрабатывает команду /chat, начиная поиск собеседника, если пользователь еще не ищет
-    :param update: обновление, полученное от пользователя
-    :param context: контекст бота
-    :return: None
-    """
-    # Обработать команду /chat в разных случаях, в зависимости от статуса пользователя
-    current_user_id = update.effective_user.id
-    current_user_status = db_connection.get_user_status(user_id=current_user_id)
-
-    if current_user_status == UserStatus.PARTNER_LEFT:
-        # Сначала проверить, был ли пользователь оставлен своим собеседником (он обновил бы статус этого пользователя на PARTNER_LEFT)
-        db_connection.set_user_status(user_id=current_user_id, new_status=UserStatus.IDLE)
-
-        return await start_search(update, context)
-    elif current_user_status == UserStatus.IN_SEARCH:
-        # Предупредить пользователя, что он уже в поиске
-        return await handle_already_in_search(update, context)
-    elif current_user_status == UserStatus.COUPLED:
-        # Дважды проверить, находится ли пользователь в чате
-        other_user = db_connection.get_partner_id(current_user_id)
-        if other_user is not None:
-            # Если пользователь уже в паре, предупредить его/ее
-            await context.bot.send_message(chat_id=current_user_id,
-                                           text="🤖 Вы уже в чате, напишите /exit, чтобы выйти из чата.")
-            return None
-        else:
-            return await start_search(update, context)
-    elif current_user_status == UserStatus.IDLE:
-        # Пользователь находится в статусе "ожидание", просто начать поиск
-        return await start_search(update, context)
-
-
-async def handle_not_in_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Обрабатывает случай, когда пользователь не находится в чате
-    :param update: обновление, полученное от пользователя
-    :param context: контекст бота
-    :return: None
-    """
-    current_user_id = update.effective_user.id
-    current_user_status = db_connection.get_user_status(user_id=current_user_id)
-
-    if current_user_status in [UserStatus.IDLE, UserStatus.PARTNER_LEFT]:
-        await context.bot.send_message(chat_id=current_user_id,
-                                       text="🤖 Вы не в чате, напишите /chat, чтобы начать поиск собеседника.")
-        return
-    elif current_user_status == UserStatus.IN_SEARCH:
-        await context.bot.send_message(chat_id=current_user_id,
-                                       text="🤖 Сообщение не доставлено, вы все еще в поиске!")
-        return
-
-
-async def handle_already_in_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Обрабатывает случай, когда пользователь уже в поиске
-    :param update: обновление, полученное от пользователя
-    :param context: контекст бота
-    :return: None
-    """
-    await context.bot.send_message(chat_id=update.effective_chat.id, text="🤖 Вы уже в поиске!")
-    return
-
-
-async def start_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Начинает поиск собеседника, устанавливает статус пользователя в "поиск" и добавляет его/ее в список пользователей
-    :param update: обновление, полученное от пользователя
-    :param context: контекст бота
-    :return: None
-    """
-    current_user_id = update.effective_chat.id
-
-    # Установить статус пользователя в "поиск"
-    db_connection.set_user_status(user_id=current_user_id, new_status=UserStatus.IN_SEARCH)
-    await context.bot.send_message(chat_id=current_user_id, text="🤖 Поиск собеседника...")
-
-    # Поиск собеседника
-    other_user_id = db_connection.couple(current_user_id=current_user_id)
-    # Если собеседник найден, уведомить обоих пользователей
-    if other_user_id is not None:
-        await context.bot.send_message(chat_id=current_user_id, text="🤖 Вы были соединены с пользователем")
-        await context.bot.send_message(chat_id=other_user_id, text="🤖 Вы были соединены с пользователем")
-
-    return
-
-
-async def handle_exit_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Обрабатывает команду /exit, выходя из чата, если пользователь находится в чате
-    :param update: обновление, полученное от пользователя
-    :param context: контекст бота
-    :return: None
-    """
-    await exit_chat(update, context)
-    return
-
-
-async def handle_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.effective_user.id)
-    if user_id == ADMIN_ID:
-        # Получение статистики
-        total_users_number, paired_users_number = db_connection.retrieve_users_number()
-        total_messages, active_users, idle_users, most_active_user = db_connection.retrieve_detailed_statistics()
-
-        # Формирование ответа
-        response = (
-            "📊 Статистика бота:\n"
-            f"👤 Всего пользователей: {total_users_number}\n"
-            f"🤝 Соединённых пар: {paired_users_number}\n"
-            f"📨 Всего сообщений: {total_messages}\n"
-            f"🔎 Пользователей в поиске: {active_users}\n"
-            f"💤 Пользователей без активности: {idle_users}\n"
-        )
-        if most_active_user:
-            response += (
-                f"🏆 Самый активный пользователь: {most_active_user[0]} "
-                f"(сообщений: {most_active_user[1]})\n"
-            )
-
-        # Отправка сообщений администратору
-        await context.bot.send_message(chat_id=user_id, text="Добро пожаловать в админ-панель")
-        await context.bot.send_message(chat_id=user_id, text=response)
-    else:
-        logging.warning(f"Пользователь {user_id} попытался получить доступ к админ-панели.")
-        await context.bot.send_message(chat_id=user_id, text="⛔️ У вас нет доступа к админ-панели.")
-
-async def exit_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Выходит из чата, отправляя сообщение другому пользователю и обновляя статус обоих пользователей
-    :param update: обновление, полученное от пользователя
-    :param context: контекст бота
-    :return: булево значение: True, если пользователь был в чате (и вышел), False в противном случае
-    """
-    current_user = update.effective_user.id
-    if db_connection.get_user_status(user_id=current_user) != UserStatus.COUPLED:
-        await context.bot.send_message(chat_id=current_user, text="🤖 Вы не в чате!")
-        return
-
-    other_user = db_connection.get_partner_id(current_user)
-    if other_user is None:
-        return
-
-    # Выполнить разъединение
-    db_connection.uncouple(user_id=current_user)
-
-    await context.bot.send_message(chat_id=current_user, text="🤖 Завершаем чат...")
-    await context.bot.send_message(chat_id=other_user,
-                                   text="🤖 Ваш собеседник покинул чат, напишите /chat, чтобы начать поиск нового собеседника.")
-    await update.message.reply_text("🤖 Вы покинули чат.")
-
-    return
-
-
-async def exit_then_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Обрабатывает команду /newchat, выходя из чата и начиная новый поиск, если пользователь находится в чате
-    :param update: обновление, полученное от пользователя
-    :param context: контекст бота
-    :return: None
-    """
-    current_user = update.effective_user.id
-    if db_connection.get_user_status(user_id=current_user) == UserStatus.IN_SEARCH:
-        return await handle_already_in_search(update, context)
-    # Если exit_chat возвращает True, то пользователь был в чате и успешно вышел
-    await exit_chat(update, context)
-    # Независимо от того, был ли пользователь в чате, начать поиск
-    return await start_search(update, context)
-
-
-async def in_chat(update: Update, other_user_id: int) -> None:
-    """
-    Пересылает сообщение от одного пользователя к другому.
-    """
-    try:
-        logging.debug(f"Пересылка сообщения от {update.effective_user.id} к {other_user_id}")
-        await update.effective_chat.copy_message(
-            chat_id=other_user_id,
-            message_id=update.message.message_id,
-            protect_content=False
-        )
-        logging.debug(f"Сообщение успешно переслано от {update.effective_user.id} к {other_user_id}")
-    except Exception as e:
-        logging.error(f"Ошибка при пересылке сообщения: {e}")
-        await update.message.reply_text("🤖 Ошибка при отправке сообщения.")
-
-def is_bot_blocked_by_user(update: Update) -> bool:
-    new_member_status = update.my_chat_member.new_chat_member.status
-    old_member_status = update.my_chat_member.old_chat_member.status
-    if new_member_status == ChatMember.BANNED and old_member_status == ChatMember.MEMBER:
-        return True
-    else:
-        return False
-
-
-async def blocked_bot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if is_bot_blocked_by_user(update):
-        # Проверить, был ли пользователь в чате
-        user_id = update.effective_user.id
-        user_status = db_connection.get_user_status(user_id=user_id)
-        if user_status == UserStatus.COUPLED:
-            other_user = db_connection.get_partner_id(user_id)
-            db_connection.uncouple(user_id=user_id)
-            await context.bot.send_message(chat_id=other_user, text="🤖 Ваш собеседник покинул чат, напишите /chat, чтобы начать поиск нового собеседника.")
-        db_connection.remove_user(user_id=user_id)
-        return ConversationHandler.END
-    else:
-        # API Telegram не предоставляет способа проверить, разблокировал ли пользователь бота
-        return USER_ACTION
-
-async def start_chat_ai(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """
-    Начинает чат с ИИ.
-    """
-    user_id = update.effective_user.id
-    db_connection.set_user_status(user_id, UserStatus.CHAT_WITH_AI)
-    await context.bot.send_message(chat_id=update.effective_chat.id,
-                                   text="🤖 Вы начали чат с ИИ. Напишите что-нибудь!")
-    return USER_CHAT_AI
-
-async def handle_chat_ai(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Обрабатывает сообщения пользователя и отправляет их в Dialogflow.
-    """
-    user_message = update.message.text
-    session_client = dialogflow.SessionsClient.from_service_account_json(DIALOGFLOW_CREDENTIALS)
-    session = session_client.session_path(PROJECT_ID, update.effective_user.id)
-
-    # Запрос к Dialogflow
-    text_input = dialogflow.TextInput(text=user_message, language_code="ru")
-    query_input = dialogflow.QueryInput(text=text_input)
-    response = session_client.detect_intent(session=session, query_input=query_input)
-
-    # Ответ Dialogflow
-    ai_response = response.query_result.fulfillment_text
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=ai_response)
-
-async def exit_chat_ai(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """
-    Завершает чат с ИИ.
-    """
-    user_id = update.effective_user.id
-    db_connection.set_user_status(user_id, UserStatus.IDLE)
-    await context.bot.send_message(chat_id=update.effective_chat.id,
-                                   text="🤖 Вы завершили чат с ИИ. Напишите /chat, чтобы начать поиск собеседника.")
-    return ConversationHandler.END
-
-# Определить статус для обработчика диалога
-USER_ACTION = 0
-USER_CHAT_AI = 1
-
-if __name__ == '__main__':
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
-    # Создать базу данных, если она еще не создана
-    db_connection.create_db()
-
-    # Сбросить статус всех предыдущих существующих пользователей на IDLE, если бот был перезапущен
-    db_connection.reset_users_status()
-
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
-        states={
-            USER_ACTION: [
-                ChatMemberHandler(blocked_bot_handler),
-                MessageHandler(
-                    (filters.TEXT | filters.ATTACHMENT) & ~ filters.COMMAND & ~filters.Regex("exit") & ~filters.Regex(
-                        "chat")
-                    & ~filters.Regex("newchat") & ~filters.Regex("stats"),
-                    handle_message),
-                CommandHandler("chat_AI", start_chat_ai),
-                CommandHandler("help", handle_help),
-                CommandHandler("chat", handle_chat),
-                CommandHandler("exit", handle_exit_chat),
-                CommandHandler("newchat", exit_then_chat),
-                CommandHandler("stats", handle_stats),
-            ],
-            USER_CHAT_AI: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_chat_ai),
-                CommandHandler("exit_AI", exit_chat_ai),
-            ],
-        },
-        fallbacks=[MessageHandler(filters.TEXT, handle_not_in_chat)],
-    )
-    application.add_handler(conv_handler)
-    application.run_polling()
+import time
+# Момент запуска (до импорта остальных модулей): от него отсчитывается холодный старт
+STARTED = time.monotonic()
+import logging
+import re
+from telegram import Update, ChatMember
+from telegram.ext import ApplicationBuilder, ContextTypes, TypeHandler
+from UserStatus import UserStatus
+from config import (BOT_TOKEN, ADMIN_ID, BOT_API_URL, CONCURRENT_UPDATES, WEBHOOK_ENABLED, WEBHOOK_LISTEN,
+                    WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL, METRICS_HOST, METRICS_PORT,
+                    SHARDS, MATCH_LANGUAGES, MATCH_MAX_TAGS)
+import db_connection
+from matchmaking import matchmaker
+from message_journal import journal
+from retention import archiver
+from ai_backend import ai_backend
+from smalltalk import smalltalk
+from sender import scheduler, Priority
+from relay import relay
+from reaper import reaper
+from broadcast import broadcaster
+from router import Router, UserUpdateProcessor
+import metrics
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.WARNING  # Установить уровень логирования: (DEBUG, INFO, WARNING, ERROR, CRITICAL)
+)
+
+# Этапы холодного старта: этап -> секунд от запуска (imports, ready, first_update; см. startup_benchmark.py)
+startup = {}
+
+
+def mark_startup(phase):
+    """Запоминает время этапа запуска (только первый раз)."""
+    startup.setdefault(phase, round(time.monotonic() - STARTED, 4))
+
+
+mark_startup("imports")
+
+"""
+####### Список команд #######
+---> start -  запускает бота
+---> help -  вывод списка команд
+---> chat - начать поиск собеседника
+---> exit -  выйти из чата
+---> chat_AI -  начать чат с ИИ
+---> exit_AI -  завершить чат с ИИ
+---> stats -  показать статистику бота (только для администратора)
+"""
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Приветствует пользователя и устанавливает его статус в "ожидании", если он/она еще не в базе данных
+    :param update: обновление, полученное от пользователя
+    :param context: контекст бота
+    :return: None
+    """
+    await scheduler.send_message(context.bot, chat_id=update.effective_chat.id,
+                                 text="Добро пожаловать в этот ChatBot! Я создан для анонимного общения или простого диалога с ИИ. 🤖\nНапишите /help, чтобы увидеть список моих возможностей.")
+
+    # Добавить пользователя в базу данных, если его там еще нет (проверка выполняется в функции)
+    user_id = update.effective_user.id
+    await db_connection.insert_user(user_id)
+
+async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает команду /help, отправляя список доступных команд
+    """
+    help_text = (
+        "🛠️ Доступные команды:\n\n"
+        "👤 Основные команды:\n"
+        "/start - Запустить бота\n"
+        "/help - Показать это сообщение\n"
+        "/chat - Найти собеседника\n"
+        "/chat ru музыка игры - Найти собеседника по языку и интересам (/chat - сбросить)\n"
+        "/exit - Завершить текущий чат\n\n"
+        "🤖 Команды для работы с ИИ:\n"
+        "/chat_AI - Начать чат с ИИ\n"
+        "/exit_AI - Завершить чат с ИИ\n\n"
+        "📊 Админ-команды:\n"
+        "/stats - Показать статистику бота (только для администратора)\n"
+        "/broadcast <текст> - Рассылка всем пользователям (только для администратора)\n"
+    )
+    await scheduler.send_message(context.bot, update.effective_chat.id, help_text)
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE, session) -> None:
+    """
+    Пересылает сообщение собеседнику (пользователь в статусе COUPLED)
+    :param update: обновление, полученное от пользователя
+    :param context: контекст бота
+    :param session: (статус, ID собеседника) из кэша сессий
+    :return: None
+    """
+    user_id = update.effective_user.id
+    other_user_id = session[1]
+    if update.message.text is None and update.message.effective_attachment is None:
+        # Служебные сообщения не пересылаются
+        return
+    logging.debug("ID партнёра для %s: %s", user_id, other_user_id)
+    if other_user_id:
+        await in_chat(update, other_user_id)
+    else:
+        logging.warning("Партнёр для пользователя %s не найден!", user_id)
+
+
+async def handle_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает команду /chat, начиная поиск собеседника, если пользователь еще не ищет
+    :param update: обновление, полученное от пользователя
+    :param context: контекст бота
+    :return: None
+    """
+    # Обработать команду /chat в разных случаях, в зависимости от статуса пользователя
+    current_user_id = update.effective_user.id
+    current_user_status = await db_connection.get_user_status(user_id=current_user_id)
+
+    if current_user_status == UserStatus.PARTNER_LEFT:
+        # Сначала проверить, был ли пользователь оставлен своим собеседником (он обновил бы статус этого пользователя на PARTNER_LEFT)
+        await db_connection.set_user_status(user_id=current_user_id, new_status=UserStatus.IDLE)
+
+        return await start_search(update, context)
+    elif current_user_status == UserStatus.IN_SEARCH:
+        # Предупредить пользователя, что он уже в поиске
+        return await handle_already_in_search(update, context)
+    elif current_user_status == UserStatus.COUPLED:
+        # Дважды проверить, находится ли пользователь в чате
+        other_user = await db_connection.get_partner_id(current_user_id)
+        if other_user is not None:
+            # Если пользователь уже в паре, предупредить его/ее
+            await scheduler.send_message(context.bot, chat_id=current_user_id,
+                                         text="🤖 Вы уже в чате, напишите /exit, чтобы выйти из чата.")
+            return None
+        else:
+            return await start_search(update, context)
+    elif current_user_status == UserStatus.IDLE:
+        # Пользователь находится в статусе "ожидание", просто начать поиск
+        return await start_search(update, context)
+
+
+async def handle_not_in_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, session) -> None:
+    """
+    Обрабатывает случай, когда пользователь не находится в чате
+    :param update: обновление, полученное от пользователя
+    :param context: контекст бота
+    :param session: (статус, ID собеседника) из кэша сессий
+    :return: None
+    """
+    current_user_id = update.effective_user.id
+    current_user_status = session[0]
+
+    if current_user_status in [UserStatus.IDLE, UserStatus.PARTNER_LEFT]:
+        await scheduler.send_message(context.bot, chat_id=current_user_id,
+                                     text="🤖 Вы не в чате, напишите /chat, чтобы начать поиск собеседника.")
+        return
+    elif current_user_status == UserStatus.IN_SEARCH:
+        await scheduler.send_message(context.bot, chat_id=current_user_id,
+                                     text="🤖 Сообщение не доставлено, вы все еще в поиске!")
+        return
+
+
+async def handle_already_in_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает случай, когда пользователь уже в поиске
+    :param update: обновление, полученное от пользователя
+    :param context: контекст бота
+    :return: None
+    """
+    await scheduler.send_message(context.bot, chat_id=update.effective_chat.id, text="🤖 Вы уже в поиске!")
+    return
+
+
+def parse_search_criteria(args):
+    """
+    Разбирает аргументы /chat: необязательный язык и интересы, например "/chat ru музыка #игры".
+    "/chat -" сбрасывает сохраненные критерии
+    :param args: аргументы команды
+    :return: (язык или None, кортеж интересов)
+    """
+    language, tags = None, []
+    for arg in args:
+        word = arg.lower().lstrip("#")
+        if not word or word == "-":
+            continue
+        if language is None and not tags and word in MATCH_LANGUAGES:
+            language = word
+        elif word not in tags and len(tags) < MATCH_MAX_TAGS:
+            tags.append(word[:32])
+    return language, tuple(tags)
+
+
+async def get_search_criteria(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Критерии поиска из аргументов команды (они же сохраняются) или сохраненные ранее."""
+    user_id = update.effective_user.id
+    if context.args:
+        language, tags = parse_search_criteria(context.args)
+        await db_connection.set_search_criteria(user_id, language, tags)
+        return language, tags
+    return await db_connection.get_search_criteria(user_id)
+
+
+async def notify_paired(bot, *user_ids) -> None:
+    """Сообщает пользователям, что собеседник найден."""
+    for user_id in user_ids:
+        await scheduler.send_message(bot, chat_id=user_id, text="🤖 Вы были соединены с пользователем")
+
+
+async def start_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Начинает поиск собеседника, устанавливает статус пользователя в "поиск" и добавляет его/ее в список пользователей
+    :param update: обновление, полученное от пользователя
+    :param context: контекст бота
+    :return: None
+    """
+    current_user_id = update.effective_chat.id
+    language, tags = await get_search_criteria(update, context)
+
+    # Установить статус пользователя в "поиск"
+    await db_connection.set_user_status(user_id=current_user_id, new_status=UserStatus.IN_SEARCH)
+    criteria = ([f"язык: {language}"] if language else []) + ([f"интересы: {', '.join(tags)}"] if tags else [])
+    await scheduler.send_message(context.bot, chat_id=current_user_id,
+                                 text=f"🤖 Поиск собеседника ({'; '.join(criteria)})..." if criteria
+                                 else "🤖 Поиск собеседника...")
+
+    # Поиск собеседника: соединить с тем, кто дольше всех ждет в тех же корзинах (язык, интерес),
+    # или встать в очередь; без пары поиск постепенно расширяется (см. matchmaking.py)
+    other_user_id = await matchmaker.find_partner(current_user_id, language, tags)
+    # Если собеседник найден, уведомить обоих пользователей
+    if other_user_id is not None:
+        await notify_paired(context.bot, current_user_id, other_user_id)
+
+    return
+
+
+async def handle_exit_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает команду /exit, выходя из чата, если пользователь находится в чате
+    :param update: обновление, полученное от пользователя
+    :param context: контекст бота
+    :return: None
+    """
+    await exit_chat(update, context)
+    return
+
+
+async def handle_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = str(update.effective_user.id)
+    if user_id == ADMIN_ID:
+        # Получение статистики
+        total_users_number, paired_users_number = await db_connection.retrieve_users_number()
+        total_messages, active_users, idle_users, most_active_user = await db_connection.retrieve_detailed_statistics()
+
+        # Формирование ответа
+        response = (
+            "📊 Статистика бота:\n"
+            f"👤 Всего пользователей: {total_users_number}\n"
+            f"🤝 Соединённых пар: {paired_users_number}\n"
+            f"📨 Всего сообщений: {total_messages}\n"
+            f"🔎 Пользователей в поиске: {active_users}\n"
+            f"💤 Пользователей без активности: {idle_users}\n"
+        )
+        cache_stats = db_connection.session_cache.stats()
+        response += (
+            f"🗂 Кэш сессий: {cache_stats['size']} записей, "
+            f"попаданий {cache_stats['hits']}, промахов {cache_stats['misses']} "
+            f"({cache_stats['hit_rate']:.0%})\n"
+        )
+        ai_stats = smalltalk.stats()
+        response += (
+            f"🤖 Чат с ИИ: локальных ответов {ai_stats['intent']}, из кэша {ai_stats['cache']}, "
+            f"через Dialogflow {ai_stats['dialogflow']} ({ai_stats['hit_rate']:.0%} без Dialogflow, "
+            f"сэкономлено {ai_stats['saved_seconds']:.1f} с)\n"
+        )
+        archive = await db_connection.get_message_archive()
+        if archive:
+            archived = sum(row[2] for row in archive)
+            response += (
+                f"🗄 В архиве: {archived} сообщений в {len(archive)} разделах "
+                f"(с {archive[0][0]}), в основной базе: {total_messages - archived}\n"
+            )
+        if most_active_user:
+            response += (
+                f"🏆 Самый активный пользователь: {most_active_user[0]} "
+                f"(сообщений: {most_active_user[1]})\n"
+            )
+
+        # Отправка сообщений администратору
+        await scheduler.send_message(context.bot, chat_id=user_id, text="Добро пожаловать в админ-панель")
+        await scheduler.send_message(context.bot, chat_id=user_id, text=response)
+    else:
+        logging.warning("Пользователь %s попытался получить доступ к админ-панели.", user_id)
+        await scheduler.send_message(context.bot, chat_id=user_id, text="⛔️ У вас нет доступа к админ-панели.")
+
+async def handle_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает команду /broadcast <текст>: рассылка сообщения всем пользователям (только для администратора)
+    """
+    user_id = str(update.effective_user.id)
+    if user_id != ADMIN_ID:
+        logging.warning("Пользователь %s попытался запустить рассылку.", user_id)
+        await scheduler.send_message(context.bot, chat_id=user_id, text="⛔️ У вас нет доступа к админ-панели.")
+        return
+
+    # Текст берется целиком, с переносами строк, а не из context.args
+    parts = update.message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await scheduler.send_message(context.bot, chat_id=user_id, text="Использование: /broadcast <текст сообщения>")
+        return
+    broadcast_id = await broadcaster.start_broadcast(context.bot, parts[1], update.effective_user.id)
+    await scheduler.send_message(context.bot, chat_id=user_id,
+                                 text=f"📣 Рассылка #{broadcast_id} запущена. Сообщу, когда она завершится.")
+
+async def exit_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Выходит из чата, отправляя сообщение другому пользователю и обновляя статус обоих пользователей
+    :param update: обновление, полученное от пользователя
+    :param context: контекст бота
+    :return: булево значение: True, если пользователь был в чате (и вышел), False в противном случае
+    """
+    current_user = update.effective_user.id
+    if await db_connection.get_user_status(user_id=current_user) != UserStatus.COUPLED:
+        await scheduler.send_message(context.bot, chat_id=current_user, text="🤖 Вы не в чате!")
+        return
+
+    other_user = await db_connection.get_partner_id(current_user)
+    if other_user is None:
+        return
+
+    # Выполнить разъединение
+    await db_connection.uncouple(user_id=current_user)
+
+    await scheduler.send_message(context.bot, chat_id=current_user, text="🤖 Завершаем чат...")
+    await scheduler.send_message(context.bot, chat_id=other_user,
+                                 text="🤖 Ваш собеседник покинул чат, напишите /chat, чтобы начать поиск нового собеседника.")
+    await scheduler.send_message(context.bot, current_user, "🤖 Вы покинули чат.")
+
+    return
+
+
+async def exit_then_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает команду /newchat, выходя из чата и начиная новый поиск, если пользователь находится в чате
+    :param update: обновление, полученное от пользователя
+    :param context: контекст бота
+    :return: None
+    """
+    current_user = update.effective_user.id
+    if await db_connection.get_user_status(user_id=current_user) == UserStatus.IN_SEARCH:
+        return await handle_already_in_search(update, context)
+    # Если exit_chat возвращает True, то пользователь был в чате и успешно вышел
+    await exit_chat(update, context)
+    # Независимо от того, был ли пользователь в чате, начать поиск
+    return await start_search(update, context)
+
+
+async def in_chat(update: Update, other_user_id: int) -> None:
+    """
+    Пересылает сообщение от одного пользователя к другому.
+    Альбомы и серии сообщений пересылаются пачками, частота сообщений одного пользователя
+    ограничена (см. relay.py). В журнал записываются только пересланные сообщения.
+    """
+    logging.debug("Пересылка сообщения от %s к %s", update.effective_user.id, other_user_id)
+    if relay.relay(update.get_bot(), update.message, other_user_id):
+        journal.record(update.effective_user.id, update.message.text or update.message.caption)
+
+def is_bot_blocked_by_user(update: Update) -> bool:
+    new_member_status = update.my_chat_member.new_chat_member.status
+    old_member_status = update.my_chat_member.old_chat_member.status
+    if new_member_status == ChatMember.BANNED and old_member_status == ChatMember.MEMBER:
+        return True
+    else:
+        return False
+
+
+async def remove_blocked_user(bot, user_id: int) -> None:
+    """
+    Удаляет пользователя, заблокировавшего бота, и отпускает его собеседника
+    :param bot: бот, через которого отправлять уведомления
+    :param user_id: ID пользователя
+    """
+    # Проверить, был ли пользователь в чате
+    user_status = await db_connection.get_user_status(user_id=user_id)
+    if user_status == UserStatus.COUPLED:
+        other_user = await db_connection.get_partner_id(user_id)
+        await db_connection.uncouple(user_id=user_id)
+        await scheduler.send_message(bot, chat_id=other_user, text="🤖 Ваш собеседник покинул чат, напишите /chat, чтобы начать поиск нового собеседника.")
+    matchmaker.cancel(user_id)
+    await db_connection.remove_user(user_id=user_id)
+
+
+async def blocked_bot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # API Telegram не предоставляет способа проверить, разблокировал ли пользователь бота
+    if is_bot_blocked_by_user(update):
+        await remove_blocked_user(context.bot, update.effective_user.id)
+
+async def start_chat_ai(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Начинает чат с ИИ.
+    """
+    user_id = update.effective_user.id
+    matchmaker.cancel(user_id)
+    # Бэкенд ИИ загружается в фоне, пока пользователь пишет первое сообщение
+    ai_backend.preload()
+    await db_connection.set_user_status(user_id, UserStatus.CHAT_WITH_AI)
+    await scheduler.send_message(context.bot, chat_id=update.effective_chat.id,
+                                 text="🤖 Вы начали чат с ИИ. Напишите что-нибудь!")
+
+async def handle_chat_ai(update: Update, context: ContextTypes.DEFAULT_TYPE, session) -> None:
+    """
+    Отвечает на сообщения пользователя: частые фразы - локально, остальные - через Dialogflow.
+    """
+    user_message = update.message.text
+    if user_message is None:
+        return
+    journal.record(update.effective_user.id, user_message)
+
+    # Локальный интент или кэш, при промахе - запрос к Dialogflow через общий клиент
+    ai_response = await smalltalk.respond(update.effective_user.id, user_message)
+    if ai_response is None:
+        ai_response = "🤖 ИИ сейчас недоступен, попробуйте позже."
+    await scheduler.send_message(context.bot, chat_id=update.effective_chat.id, text=ai_response,
+                                 priority=Priority.RELAY)
+
+async def exit_chat_ai(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Завершает чат с ИИ.
+    """
+    user_id = update.effective_user.id
+    await db_connection.set_user_status(user_id, UserStatus.IDLE)
+    await scheduler.send_message(context.bot, chat_id=update.effective_chat.id,
+                                 text="🤖 Вы завершили чат с ИИ. Напишите /chat, чтобы начать поиск собеседника.")
+
+async def handle_not_started(update: Update, context: ContextTypes.DEFAULT_TYPE, session) -> None:
+    """Отвечает пользователю, которого еще нет в базе данных (он не нажимал /start)."""
+    await scheduler.send_message(context.bot, update.effective_chat.id, "🤖 Напишите /start, чтобы начать.")
+
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Отмечает активность пользователя для завершения брошенных поисков и чатов (reaper.py);
+    раз пользователь пишет боту, пересылка ему снова возможна (relay.py)
+    """
+    if update.effective_user is not None:
+        reaper.touch(update.effective_user.id)
+        relay.reachable(update.effective_user.id)
+
+async def reap_session(bot, user_id: int, status: str, partner_id: int | None) -> None:
+    """
+    Завершает поиск или чат пользователя, который долго ничего не присылал
+    :param bot: бот, через которого отправлять уведомления
+    :param user_id: неактивный пользователь
+    :param status: его статус
+    :param partner_id: его собеседник (для статуса COUPLED)
+    """
+    if status == UserStatus.IN_SEARCH:
+        matchmaker.cancel(user_id)
+        # Статус меняется, только если пользователя не успели соединить с собеседником
+        if await db_connection.reset_status_if(user_id, UserStatus.IN_SEARCH):
+            await scheduler.send_message(bot, chat_id=user_id,
+                                         text="🤖 Собеседник не нашелся, поиск остановлен. Напишите /chat, чтобы искать снова.")
+    elif status == UserStatus.COUPLED:
+        await db_connection.uncouple(user_id=user_id)
+        # Уведомить собеседника, если он сам еще активен
+        if partner_id is not None and reaper.is_active(partner_id):
+            await scheduler.send_message(bot, chat_id=partner_id,
+                                         text="🤖 Собеседник давно не отвечает, чат завершен. Напишите /chat, чтобы начать поиск нового собеседника.")
+
+async def track_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отмечает первое обновление, полностью обработанное после запуска (группа 1 - после диспетчера)."""
+    if "first_update" not in startup:
+        mark_startup("first_update")
+        logging.warning("Холодный старт: импорт %.2f с, готов к работе %.2f с, первое обновление %.2f с.",
+                        startup["imports"], startup["ready"], startup["first_update"])
+
+# Статусы, в которых доступны основные команды (все, кроме чата с ИИ)
+ACTION_STATUSES = (UserStatus.IDLE, UserStatus.IN_SEARCH, UserStatus.COUPLED, UserStatus.PARTNER_LEFT)
+
+
+async def on_startup(application) -> None:
+    """
+    Открывает соединения с базой данных перед получением первых обновлений
+    """
+    await db_connection.init()
+    # Создать базу данных, если она еще не создана
+    await db_connection.create_db()
+
+    # Пары и статусы переживают перезапуск; в памяти нужно восстановить только очередь поиска
+    await matchmaker.restore()
+    # Пары, найденные при расширении поиска, уведомляются отсюда (не из обработчика /chat)
+    matchmaker.on_match = lambda user_id, partner_id: notify_paired(application.bot, user_id, partner_id)
+
+    # Фоновая запись пересланных сообщений в таблицу messages
+    journal.start()
+    # Перенос старых сообщений в архивные разделы по месяцам
+    archiver.start()
+
+    # Завершение брошенных поисков и чатов
+    reaper.on_expire = lambda user_id, status, partner_id: reap_session(application.bot, user_id, status, partner_id)
+    await reaper.restore()
+    reaper.start()
+
+    # Рассылки, прерванные остановкой бота, продолжаются с контрольной точки
+    broadcaster.on_blocked = lambda user_id: remove_blocked_user(application.bot, user_id)
+    # Собеседник, заблокировавший бота, удаляется после первой неудачной пересылки
+    relay.on_blocked = lambda user_id: remove_blocked_user(application.bot, user_id)
+    await broadcaster.resume(application.bot)
+
+    # Локальные ответы на частые фразы; бэкенд ИИ загружается при первом входе в чат с ИИ
+    smalltalk.backend = ai_backend.detect_intent
+    smalltalk.load()
+
+    # Планировщик исходящих сообщений с учетом лимитов Telegram
+    scheduler.start()
+
+    # HTTP endpoint с метриками в формате Prometheus
+    if METRICS_PORT is not None:
+        metrics.registry.gauge("bot_send_queue_depth",
+                               lambda: {(("lane", lane),): depth
+                                        for lane, depth in scheduler.stats()["queue_depth"].items()},
+                               "Запросы к Bot API, ожидающие отправки")
+        metrics.registry.gauge("bot_session_cache",
+                               lambda: {(("value", name),): value
+                                        for name, value in db_connection.session_cache.stats().items()},
+                               "Размер и попадания кэша сессий")
+        metrics.registry.gauge("bot_reaper",
+                               lambda: {(("value", name),): value for name, value in reaper.stats().items()},
+                               "Пользователи и таймеры, отслеживаемые для завершения неактивных сессий")
+        metrics.registry.gauge("bot_smalltalk",
+                               lambda: {(("value", name),): value for name, value in smalltalk.stats().items()},
+                               "Локальные ответы в чате с ИИ: попадания и сэкономленное время ожидания Dialogflow")
+        metrics.registry.gauge("bot_startup_seconds",
+                               lambda: {(("phase", phase),): seconds for phase, seconds in startup.items()},
+                               "Этапы холодного старта: секунд от запуска процесса")
+        metrics_server = await metrics.start_server(METRICS_PORT, METRICS_HOST)
+        if metrics_server is not None:
+            application.bot_data["metrics_server"] = metrics_server
+
+    mark_startup("ready")
+
+
+async def on_stop(application) -> None:
+    """
+    Досылает накопленные сообщения после остановки приема обновлений, пока клиент Bot API
+    еще открыт (Application.shutdown() закрывает его раньше post_shutdown)
+    """
+    await reaper.stop()
+    await relay.stop()
+    await broadcaster.stop()
+    await scheduler.stop()
+
+
+async def on_shutdown(application) -> None:
+    """
+    Записывает остаток журнала сообщений и закрывает соединения с базой данных при остановке бота
+    """
+    if "metrics_server" in application.bot_data:
+        application.bot_data.pop("metrics_server").close()
+    await archiver.stop()
+    await journal.stop()
+    ai_backend.close()
+    await db_connection.close()
+
+
+def check_webhook_settings():
+    """
+    Не дает запустить webhook с небезопасными настройками: без секретного токена (или с
+    заготовкой из примера) сервер принимал бы обновления от кого угодно, а без WEBHOOK_URL
+    Telegram получил бы адрес вида https://0.0.0.0:8443/... (вызывается только при WEBHOOK_ENABLED)
+    """
+    if (not WEBHOOK_SECRET or WEBHOOK_SECRET == "change_me"
+            or not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET)):
+        raise SystemExit("WEBHOOK_SECRET не задан или некорректен: укажите в config.py случайную строку "
+                         "из 1-256 символов A-Z, a-z, 0-9, _ и -.")
+    if not WEBHOOK_URL:
+        raise SystemExit("WEBHOOK_URL не задан: укажите в config.py публичный адрес webhook.")
+
+
+def build_application(token=BOT_TOKEN, base_url=BOT_API_URL, updater=True):
+    """
+    Создает приложение со всеми обработчиками
+    :param token: токен бота
+    :param base_url: адрес Bot API (None - стандартный api.telegram.org)
+    :param updater: False - обновления кладет в update_queue вызывающий код (шарды, нагрузочный тест)
+    :return: объект Application
+    """
+    builder = (ApplicationBuilder().token(token)
+               .concurrent_updates(UserUpdateProcessor(CONCURRENT_UPDATES))
+               .post_init(on_startup)
+               .post_stop(on_stop)
+               .post_shutdown(on_shutdown))
+    if base_url:
+        # Локальный (поддельный) Bot API для тестов
+        builder = builder.base_url(base_url)
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
+
+    # Обработчик выбирается по статусу пользователя из кэша сессий (см. router.py)
+    router = Router()
+    router.command("start", start, (None, *UserStatus.possible_states))
+    for name, callback in (("chat_AI", start_chat_ai), ("help", handle_help), ("chat", handle_chat),
+                           ("exit", handle_exit_chat), ("newchat", exit_then_chat), ("stats", handle_stats),
+                           ("broadcast", handle_broadcast)):
+        router.command(name, callback, ACTION_STATUSES)
+    router.command("exit_AI", exit_chat_ai, (UserStatus.CHAT_WITH_AI,))
+    router.message(handle_message, (UserStatus.COUPLED,))
+    router.message(handle_not_in_chat, (UserStatus.IDLE, UserStatus.IN_SEARCH, UserStatus.PARTNER_LEFT))
+    router.message(handle_chat_ai, (UserStatus.CHAT_WITH_AI,))
+    router.unknown_command(handle_not_in_chat, ACTION_STATUSES)
+    router.message(handle_not_started, (None,))
+    router.unknown_command(handle_not_started, (None,))
+    router.on_chat_member = metrics.timed(blocked_bot_handler)
+
+    # Отметка активности выполняется до диспетчера (группа -1) и не прерывает его
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
+    application.add_handler(TypeHandler(Update, router.dispatch))
+    application.add_handler(TypeHandler(Update, track_first_update), group=1)
+    return application
+
+
+if __name__ == '__main__':
+    if WEBHOOK_ENABLED:
+        check_webhook_settings()
+    if SHARDS > 1:
+        # Несколько процессов-обработчиков, см. shards.py
+        import shards
+        shards.main(SHARDS)
+        raise SystemExit
+    application = build_application()
+    if WEBHOOK_ENABLED:
+        # Telegram сам присылает обновления на встроенный HTTP сервер; запросы без
+        # правильного секретного токена отклоняются
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            webhook_url=WEBHOOK_URL,
+        )
+    else:
+        application.run_polling()
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from config import BROADCAST_PAGE_SIZE, BROADCAST_CONCURRENCY, BROADCAST_RATE
+from sender import scheduler, Priority, TokenBucket, is_unreachable
+import db_connection
+import metrics
+
+
+class Broadcaster:
+    """
+    Рассылка сообщения всем пользователям.
+    ID читаются из базы страницами по первичному ключу, сообщения отправляются в полосе BULK
+    планировщика (пересылка в чатах всегда идет вперед) с ограничением числа одновременных
+    отправок и собственной скорости. После каждой страницы прогресс записывается в таблицу
+    broadcasts, поэтому после перезапуска рассылка продолжается с последней контрольной точки
+    (пользователи недописанной страницы могут получить сообщение повторно).
+    """
+
+    def __init__(self, page_size=BROADCAST_PAGE_SIZE, concurrency=BROADCAST_CONCURRENCY, rate=BROADCAST_RATE):
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.rate = rate
+        # Корутина on_blocked(user_id): пользователь заблокировал бота
+        self.on_blocked = None
+        # Продолжать ли незавершенные рассылки при запуске (в многопроцессном режиме - один шард)
+        self.resume_on_start = True
+        self._tasks = {}  # ID рассылки -> задача
+        self._bucket = TokenBucket(rate, rate)
+
+    def __len__(self):
+        return len(self._tasks)
+
+    async def start_broadcast(self, bot, text, admin_id):
+        """Создает рассылку и запускает ее в фоне. Возвращает ID рассылки."""
+        broadcast_id = await db_connection.create_broadcast(text, admin_id)
+        self._spawn(bot, broadcast_id, text, admin_id, 0, {"sent": 0, "failed": 0, "removed": 0})
+        return broadcast_id
+
+    async def resume(self, bot):
+        """Продолжает рассылки, прерванные остановкой бота."""
+        if not self.resume_on_start:
+            return
+        for broadcast_id, text, admin_id, last_user_id, sent, failed, removed in \
+                await db_connection.get_unfinished_broadcasts():
+            logging.warning("Продолжение рассылки #%s с пользователя %s.", broadcast_id, last_user_id)
+            self._spawn(bot, broadcast_id, text, admin_id, last_user_id,
+                        {"sent": sent, "failed": failed, "removed": removed})
+
+    def _spawn(self, bot, broadcast_id, text, admin_id, last_user_id, counts):
+        task = asyncio.create_task(self._run(bot, broadcast_id, text, admin_id, last_user_id, counts))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _run(self, bot, broadcast_id, text, admin_id, last_user_id, counts):
+        slots = asyncio.Semaphore(self.concurrency)
+        try:
+            while True:
+                user_ids = await db_connection.get_user_ids_page(last_user_id, self.page_size)
+                if not user_ids:
+                    break
+                await asyncio.gather(*(self._send(bot, user_id, text, counts, slots) for user_id in user_ids))
+                last_user_id = user_ids[-1]
+                await db_connection.save_broadcast_progress(broadcast_id, last_user_id, counts["sent"],
+                                                            counts["failed"], counts["removed"])
+            await db_connection.finish_broadcast(broadcast_id)
+        except Exception as e:
+            # Прогресс сохранен на последней контрольной точке: рассылка продолжится при следующем запуске
+            logging.error("Рассылка #%s прервана после пользователя %s: %s", broadcast_id, last_user_id, e)
+            if admin_id:
+                try:
+                    await scheduler.send_message(bot, chat_id=admin_id,
+                                                 text=f"📣 Рассылка #{broadcast_id} прервана из-за ошибки: {e}. "
+                                                      f"Отправлено {counts['sent']}; рассылка продолжится "
+                                                      f"с контрольной точки при следующем запуске бота.")
+                except Exception as e:
+                    logging.error("Ошибка при отправке уведомления %s: %s", admin_id, e)
+            return
+        logging.warning("Рассылка #%s завершена: %s.", broadcast_id, counts)
+        if admin_id:
+            await scheduler.send_message(bot, chat_id=admin_id,
+                                         text=f"📣 Рассылка #{broadcast_id} завершена: отправлено {counts['sent']}, "
+                                              f"ошибок {counts['failed']}, удалено заблокировавших бота "
+                                              f"{counts['removed']}.")
+
+    async def _send(self, bot, user_id, text, counts, slots):
+        async with slots:
+            wait = self._bucket.take()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self._bucket.take()
+            try:
+                await scheduler.send_message(bot, chat_id=user_id, text=text, priority=Priority.BULK)
+                outcome = "sent"
+            except Exception as e:
+                if not is_unreachable(e):
+                    outcome = "failed"
+                    logging.debug("Ошибка рассылки пользователю %s: %s", user_id, e)
+                else:
+                    # Пользователь заблокировал бота или удалил аккаунт
+                    outcome = "removed"
+                    if self.on_blocked is not None:
+                        try:
+                            await self.on_blocked(user_id)
+                        except Exception as e:
+                            logging.error("Ошибка при удалении пользователя %s: %s", user_id, e)
+            counts[outcome] += 1
+            metrics.registry.counter("bot_broadcast_messages_total", outcome=outcome).inc()
+
+    async def stop(self):
+        """Прерывает рассылки; они продолжатся с контрольной точки при следующем запуске."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+broadcaster = Broadcaster()
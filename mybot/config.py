@@ -1,5 +1,70 @@
-# config.py
-BOT_TOKEN = "токен"
-ADMIN_ID = "айди тг"
-DIALOGFLOW_CREDENTIALS = "small-talk-qpp9-01bbaad3cc34.json"  
-PROJECT_ID = "small-talk-qpp9"  
+# config.py
+BOT_TOKEN = "токен"
+ADMIN_ID = "айди тг"
+DIALOGFLOW_CREDENTIALS = "small-talk-qpp9-01bbaad3cc34.json"  
+PROJECT_ID = "small-talk-qpp9"  
+
+# База данных
+DB_PATH = "chatbot_database.db"
+DB_READERS = 4  # размер пула соединений для чтения
+DB_MMAP_SIZE = 256 * 1024 * 1024  # сколько байт базы отображать в память (PRAGMA mmap_size)
+SESSION_CACHE_SIZE = 100_000  # максимум сессий (status, partner_id) в памяти
+
+# Журнал сообщений
+JOURNAL_BATCH_SIZE = 500  # сбросить буфер, когда накопится столько сообщений
+JOURNAL_FLUSH_INTERVAL = 2.0  # ... или не реже, чем раз в столько секунд
+JOURNAL_MAX_BUFFER = 50_000  # пока база недоступна, хранить в памяти не больше стольких сообщений
+
+# Хранение сообщений (retention.py)
+RETENTION_DAYS = 30  # сообщения старше стольких дней переносятся в архив; None - хранить всё в основной базе
+RETENTION_ARCHIVE_DIR = "archive"  # папка архивных разделов messages-ГГГГ-ММ.db(.gz)
+RETENTION_BATCH_SIZE = 1000  # сообщений за одну транзакцию переноса
+RETENTION_BATCH_PAUSE = 0.05  # пауза между транзакциями в секундах (запись журнала не ждет долго)
+RETENTION_INTERVAL = 3600  # как часто проверять таблицу messages, в секундах
+RETENTION_VACUUM_PAGES = 1000  # страниц, возвращаемых файловой системе за одну транзакцию
+
+# Чат с ИИ
+AI_BACKEND = "ai_client.DialogflowClient"  # "модуль.Класс" бэкенда; загружается при первом /chat_AI (ai_backend.py)
+DIALOGFLOW_ENDPOINT = None  # "localhost:50051" - локальный сервер для тестов (см. fake_dialogflow.py)
+AI_MAX_CONCURRENCY = 8  # максимум одновременных запросов к Dialogflow
+AI_REQUEST_TIMEOUT = 5.0  # таймаут одного запроса в секундах
+SMALLTALK_INTENTS = "smalltalk_intents.json"  # локальные интенты: файл JSON или папка выгрузки агента Dialogflow
+SMALLTALK_MIN_SCORE = 0.75  # минимальное сходство фразы с интентом для локального ответа (0..1)
+SMALLTALK_CACHE_SIZE = 10_000  # максимум ответов Dialogflow в кэше
+SMALLTALK_CACHE_TTL = 3600  # сколько секунд хранить ответ Dialogflow в кэше
+
+# Подбор собеседника
+MATCH_LANGUAGES = ("ru", "en", "uk", "be", "kk", "uz", "de", "es", "fr", "it", "pl", "tr")  # языки в /chat
+MATCH_MAX_TAGS = 5  # максимум интересов у одного пользователя
+MATCH_FALLBACK_WAIT = 30.0  # секунд ожидания перед переходом к более широкому поиску
+
+# Исходящие сообщения (лимиты Bot API)
+BOT_API_URL = None  # "http://localhost:8081/bot" - локальный (поддельный) Bot API для тестов
+SEND_GLOBAL_RATE = 30  # сообщений в секунду на всего бота
+SEND_GLOBAL_BURST = 30
+SEND_CHAT_RATE = 1  # сообщений в секунду в один чат
+SEND_CHAT_BURST = 3
+SEND_MAX_IN_FLIGHT = 50  # одновременных запросов к Bot API
+SEND_MAX_RETRIES = 3  # повторов после ответа 429
+RELAY_ALBUM_WINDOW = 0.3  # сколько секунд ждать остальные части альбома перед пересылкой одним запросом
+RELAY_USER_RATE = 1  # сообщений в секунду, которые один пользователь может переслать собеседнику (альбом - одно)
+RELAY_USER_BURST = 10  # ... и подряд без пауз; остальные не пересылаются
+
+# Рассылки (/broadcast)
+BROADCAST_PAGE_SIZE = 500  # сколько ID пользователей читать из базы за раз (после каждой страницы - контрольная точка)
+BROADCAST_CONCURRENCY = 20  # одновременно отправляемых сообщений рассылки
+BROADCAST_RATE = 20  # сообщений рассылки в секунду; остаток общего лимита остается чатам
+
+# Получение обновлений
+CONCURRENT_UPDATES = 64  # сколько обновлений разных пользователей обрабатывается одновременно (одного - по очереди)
+WEBHOOK_ENABLED = False  # False - run_polling, True - встроенный HTTP сервер для webhook
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "telegram"
+WEBHOOK_SECRET = None  # обязателен для webhook: 1-256 символов A-Z, a-z, 0-9, _ и -; проверяется в каждом запросе
+WEBHOOK_URL = None  # обязателен для webhook: публичный адрес, например "https://bot.example.com/telegram"
+SHARDS = 1  # процессов-обработчиков; 1 - всё в одном процессе, N > 1 - входной процесс + N шардов (shards.py)
+
+# Метрики (Prometheus)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None  # порт HTTP endpoint /metrics (шарды: порт + 1 + номер); None - не запускать
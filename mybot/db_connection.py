@@ -1,153 +1,433 @@
-import sqlite3
-from UserStatus import UserStatus
-import logging
-
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.DEBUG 
-)
-def create_db():
-    """Создает таблицу пользователей, если она не существует."""
-    conn = sqlite3.connect('chatbot_database.db')
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            status TEXT,
-            partner_id TEXT
-        );
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            message_text TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        );
-    """)
-    conn.commit()
-    conn.close()
-
-def insert_user(user_id):
-    """Добавляет нового пользователя в базу данных, если он еще не существует."""
-    conn = sqlite3.connect('chatbot_database.db')
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-    if c.fetchone():
-        conn.close()
-        logging.debug(f"Пользователь {user_id} уже существует.")
-        return
-    c.execute("INSERT INTO users (user_id, status, partner_id) VALUES (?, ?, ?)", (user_id, UserStatus.IDLE, None))
-    conn.commit()
-    conn.close()
-    logging.debug(f"Пользователь {user_id} добавлен с статусом {UserStatus.IDLE}.")
-
-def remove_user(user_id):
-    """Удаляет пользователя из базы данных и обновляет статус партнера, если он существует."""
-    conn = sqlite3.connect('chatbot_database.db')
-    c = conn.cursor()
-    partner_id = get_partner_id(user_id)
-    if partner_id:
-        c.execute("UPDATE users SET partner_id=NULL WHERE user_id=?", (partner_id,))
-        set_user_status(partner_id, UserStatus.PARTNER_LEFT)
-    c.execute("DELETE FROM users WHERE user_id=?", (user_id,))
-    conn.commit()
-    conn.close()
-
-def get_user_status(user_id):
-    """Возвращает статус пользователя."""
-    conn = sqlite3.connect('chatbot_database.db')
-    c = conn.cursor()
-    c.execute("SELECT status FROM users WHERE user_id=?", (user_id,))
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else UserStatus.IDLE
-
-def set_user_status(user_id, new_status):
-    """Устанавливает новый статус для пользователя."""
-    conn = sqlite3.connect('chatbot_database.db')
-    c = conn.cursor()
-    c.execute("UPDATE users SET status=? WHERE user_id=?", (new_status, user_id))
-    conn.commit()
-    conn.close()
-    logging.debug(f"Статус пользователя {user_id} изменён на {new_status}.")
-
-def get_partner_id(user_id):
-    """Возвращает ID партнера пользователя."""
-    conn = sqlite3.connect('chatbot_database.db')
-    c = conn.cursor()
-    c.execute("SELECT partner_id FROM users WHERE user_id=?", (user_id,))
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else None
-
-def couple(current_user_id):
-    """Соединяет двух пользователей в чате."""
-    conn = sqlite3.connect('chatbot_database.db')
-    c = conn.cursor()
-    c.execute("SELECT user_id FROM users WHERE status=? AND user_id!=?", (UserStatus.IN_SEARCH, current_user_id))
-    other_user_id = c.fetchone()
-    if not other_user_id:
-        conn.close()
-        return None
-    other_user_id = other_user_id[0]
-    c.execute("UPDATE users SET partner_id=? WHERE user_id=?", (other_user_id, current_user_id))
-    c.execute("UPDATE users SET partner_id=? WHERE user_id=?", (current_user_id, other_user_id))
-    c.execute("UPDATE users SET status=? WHERE user_id=?", (UserStatus.COUPLED, current_user_id))
-    c.execute("UPDATE users SET status=? WHERE user_id=?", (UserStatus.COUPLED, other_user_id))
-    conn.commit()
-    conn.close()
-    return other_user_id
-
-def uncouple(user_id):
-    """Разъединяет пользователя с его партнером."""
-    conn = sqlite3.connect('chatbot_database.db')
-    c = conn.cursor()
-    partner_id = get_partner_id(user_id)
-    if not partner_id:
-        conn.close()
-        return
-    c.execute("UPDATE users SET partner_id=NULL WHERE user_id=?", (user_id,))
-    c.execute("UPDATE users SET partner_id=NULL WHERE user_id=?", (partner_id,))
-    c.execute("UPDATE users SET status=? WHERE user_id=?", (UserStatus.IDLE, user_id))
-    c.execute("UPDATE users SET status=? WHERE user_id=?", (UserStatus.IDLE, partner_id))
-    conn.commit()
-    conn.close()
-
-def retrieve_users_number():
-    """Возвращает количество пользователей и количество пар."""
-    conn = sqlite3.connect('chatbot_database.db')
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM users")
-    total_users_number = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM users WHERE status=?", (UserStatus.COUPLED,))
-    paired_users_number = c.fetchone()[0]
-    conn.close()
-    return total_users_number, paired_users_number
-
-def reset_users_status():
-    """Сбрасывает статус всех пользователей на IDLE при перезапуске бота."""
-    conn = sqlite3.connect('chatbot_database.db')
-    c = conn.cursor()
-    c.execute("UPDATE users SET status=?, partner_id=NULL", (UserStatus.IDLE,))
-    conn.commit()
-    conn.close()
-
-def retrieve_detailed_statistics():
-    conn = sqlite3.connect('chatbot_database.db')
-    c = conn.cursor()
-
-    # Пример запросов к базе данных
-    total_messages = c.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
-    active_users = c.execute("SELECT COUNT(*) FROM users WHERE status = 'in_search'").fetchone()[0]
-    idle_users = c.execute("SELECT COUNT(*) FROM users WHERE status = 'idle'").fetchone()[0]
-    most_active_user = c.execute("""
-        SELECT user_id, COUNT(*) as message_count 
-        FROM messages 
-        GROUP BY user_id 
-        ORDER BY message_count DESC 
-        LIMIT 1
-    """).fetchone()
-
-    conn.close()
-    return total_messages, active_users, idle_users, most_active_user
+import asyncio
+from collections import Counter
+import queue
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from UserStatus import UserStatus
+from config import DB_PATH, DB_READERS, SESSION_CACHE_SIZE, DB_MMAP_SIZE
+from session_cache import SessionCache
+import migrations
+import metrics
+import logging
+
+# Долгоживущие соединения: один писатель (все записи идут через один поток и сериализуются)
+# и небольшой пул читателей. Все запросы выполняются вне цикла событий.
+_writer = None
+_writer_executor = None
+_readers = None
+_reader_executor = None
+
+# Кэш (status, partner_id) для горячего пути пересылки сообщений.
+# Обновляется только из цикла событий после фиксации транзакции.
+session_cache = SessionCache(SESSION_CACHE_SIZE)
+
+# Число обращений к базе данных (для нагрузочных тестов)
+query_counts = {"read": 0, "write": 0}
+
+# Тексты запросов вынесены в константы: sqlite3 кэширует подготовленные выражения
+# для каждого соединения, и одинаковая строка запроса повторно не компилируется.
+SQL_GET_USER = "SELECT user_id FROM users WHERE user_id=?"
+SQL_INSERT_USER = "INSERT INTO users (user_id, status, partner_id) VALUES (?, ?, ?)"
+SQL_DELETE_USER = "DELETE FROM users WHERE user_id=?"
+SQL_GET_SESSION = "SELECT status, partner_id FROM users WHERE user_id=?"
+SQL_SET_STATUS = "UPDATE users SET status=? WHERE user_id=?"
+SQL_GET_PARTNER = "SELECT partner_id FROM users WHERE user_id=?"
+SQL_SET_SESSION = "UPDATE users SET status=?, partner_id=? WHERE user_id=?"
+SQL_INSERT_MESSAGE = "INSERT INTO messages (user_id, message_text, timestamp) VALUES (?, ?, ?)"
+SQL_PAIR_USER = "UPDATE users SET status=?, partner_id=? WHERE user_id=? AND status=?"
+SQL_RESET_SESSION = "UPDATE users SET status=?, partner_id=NULL WHERE user_id=? AND status=?"
+SQL_GET_USERS_BY_STATUS = "SELECT user_id FROM users WHERE status=?"
+SQL_GET_USER_IDS_PAGE = "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?"
+SQL_SAVE_BROADCAST = "UPDATE broadcasts SET last_user_id=?, sent=?, failed=?, removed=? WHERE id=?"
+SQL_GET_CRITERIA = "SELECT language, tags FROM users WHERE user_id=?"
+SQL_SET_CRITERIA = "UPDATE users SET language=?, tags=? WHERE user_id=?"
+SQL_GET_SEARCHING = "SELECT user_id, language, tags FROM users WHERE status=?"
+# Архивируются только строки с датой в timestamp (ГГГГ-ММ-ДД...): строки с NULL или испорченным
+# временем не относятся ни к одному месяцу и остаются в таблице, не останавливая перенос остальных
+SQL_DATED_MESSAGE = "timestamp GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'"
+SQL_OLDEST_MESSAGE = f"SELECT timestamp FROM messages WHERE {SQL_DATED_MESSAGE} ORDER BY id LIMIT 1"
+SQL_MESSAGES_HEAD = (f"SELECT id, user_id, message_text, timestamp FROM messages WHERE {SQL_DATED_MESSAGE} "
+                     "ORDER BY id LIMIT ?")
+SQL_DELETE_MESSAGE = "DELETE FROM messages WHERE id=?"
+SQL_COUNT_ARCHIVED_DAY = ("INSERT INTO message_days (day, messages) VALUES (?, ?) "
+                          "ON CONFLICT(day) DO UPDATE SET messages = messages + excluded.messages")
+SQL_COUNT_ARCHIVED_MONTH = ("INSERT INTO message_archive (month, path, messages, first_at, last_at) VALUES (?, ?, ?, ?, ?) "
+                            "ON CONFLICT(month) DO UPDATE SET messages = messages + excluded.messages, "
+                            "first_at = min(first_at, excluded.first_at), last_at = max(last_at, excluded.last_at)")
+
+
+def _to_id(value):
+    """Приводит ID из базы данных к int (до миграции 3 ключи хранились как TEXT)."""
+    return int(value) if value is not None else None
+
+
+def _to_tags(value):
+    """Интересы хранятся в одной строке через пробел."""
+    return tuple(value.split()) if value else ()
+
+
+def _connect(path):
+    """Открывает соединение с базой данных в режиме WAL."""
+    conn = sqlite3.connect(path, check_same_thread=False, cached_statements=256)
+    # Для новой базы: страницы, освобожденные при переносе сообщений в архив, возвращаются
+    # файловой системе по частям (retention.py). Для существующей базы действует только после VACUUM
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    # В режиме WAL NORMAL не теряет целостность при сбое и не делает fsync на каждый коммит
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={int(DB_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+async def init(path=DB_PATH, readers=DB_READERS):
+    """Открывает соединение для записи и пул соединений для чтения."""
+    global _writer, _writer_executor, _readers, _reader_executor
+    if _writer is not None:
+        return
+    _writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+    _reader_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+    loop = asyncio.get_running_loop()
+    _writer = await loop.run_in_executor(_writer_executor, _connect, path)
+    _readers = queue.Queue()
+    for _ in range(readers):
+        _readers.put(await loop.run_in_executor(_reader_executor, _connect, path))
+    logging.debug("Соединения с базой данных %s открыты (читателей: %s).", path, readers)
+
+
+async def close():
+    """Закрывает все соединения с базой данных."""
+    global _writer, _writer_executor, _readers, _reader_executor
+    if _writer is None:
+        return
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_writer_executor, _writer.close)
+    while not _readers.empty():
+        _readers.get_nowait().close()
+    _writer_executor.shutdown()
+    _reader_executor.shutdown()
+    _writer = _writer_executor = _readers = _reader_executor = None
+
+
+def _run_read(fn):
+    conn = _readers.get()
+    try:
+        return fn(conn.cursor())
+    finally:
+        _readers.put(conn)
+
+
+def _run_write(fn):
+    # Контекстный менеджер соединения фиксирует транзакцию или откатывает её при ошибке
+    with _writer:
+        return fn(_writer.cursor())
+
+
+async def _read(name, fn):
+    """Выполняет fn(cursor) на свободном соединении для чтения; name - имя запроса для метрик."""
+    query_counts["read"] += 1
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_reader_executor, _run_read, fn)
+    finally:
+        metrics.registry.histogram("bot_db_query_seconds", query=name).observe(time.perf_counter() - started)
+
+
+async def _write(name, fn):
+    """Выполняет fn(cursor) в одной транзакции на соединении для записи; name - имя запроса для метрик."""
+    query_counts["write"] += 1
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_writer_executor, _run_write, fn)
+    finally:
+        metrics.registry.histogram("bot_db_query_seconds", query=name).observe(time.perf_counter() - started)
+
+
+async def create_db():
+    """
+    Создает или обновляет схему базы данных до последней версии
+    :return: версия схемы
+    """
+    loop = asyncio.get_running_loop()
+    old_version, version = await loop.run_in_executor(_writer_executor, migrations.migrate, _writer)
+    if old_version != version:
+        logging.warning("Схема базы данных обновлена: версия %s -> %s.", old_version, version)
+    else:
+        logging.info("Схема базы данных: версия %s.", version)
+    return version
+
+async def insert_user(user_id):
+    """Добавляет нового пользователя в базу данных, если он еще не существует."""
+    def run(c):
+        if c.execute(SQL_GET_USER, (user_id,)).fetchone():
+            return False
+        c.execute(SQL_INSERT_USER, (user_id, UserStatus.IDLE, None))
+        return True
+
+    if await _write("insert_user", run):
+        session_cache.put(user_id, UserStatus.IDLE, None)
+        logging.debug("Пользователь %s добавлен с статусом %s.", user_id, UserStatus.IDLE)
+    else:
+        logging.debug("Пользователь %s уже существует.", user_id)
+
+async def remove_user(user_id):
+    """Удаляет пользователя из базы данных и обновляет статус партнера, если он существует."""
+    def run(c):
+        result = c.execute(SQL_GET_PARTNER, (user_id,)).fetchone()
+        partner_id = _to_id(result[0]) if result else None
+        if partner_id:
+            c.execute(SQL_SET_SESSION, (UserStatus.PARTNER_LEFT, None, partner_id))
+        c.execute(SQL_DELETE_USER, (user_id,))
+        return partner_id
+
+    partner_id = await _write("remove_user", run)
+    session_cache.discard(user_id)
+    if partner_id:
+        session_cache.put(partner_id, UserStatus.PARTNER_LEFT, None)
+
+async def get_session(user_id):
+    """
+    Возвращает (status, partner_id) пользователя или None, если его нет в базе данных.
+    Сначала проверяется кэш сессий, в базу данных запрос идет только при промахе.
+    """
+    session = session_cache.get(user_id)
+    if session is not None:
+        return session
+    result = await _read("get_session", lambda c: c.execute(SQL_GET_SESSION, (user_id,)).fetchone())
+    if result is None:
+        return None
+    session_cache.add(user_id, result[0], _to_id(result[1]))
+    return result[0], _to_id(result[1])
+
+async def get_user_status(user_id):
+    """Возвращает статус пользователя."""
+    session = await get_session(user_id)
+    return session[0] if session else UserStatus.IDLE
+
+async def set_user_status(user_id, new_status):
+    """Устанавливает новый статус для пользователя."""
+    def run(c):
+        c.execute(SQL_SET_STATUS, (new_status, user_id))
+        return c.execute(SQL_GET_PARTNER, (user_id,)).fetchone()
+
+    result = await _write("set_user_status", run)
+    if result is not None:
+        session_cache.put(user_id, new_status, _to_id(result[0]))
+    logging.debug("Статус пользователя %s изменён на %s.", user_id, new_status)
+
+async def reset_status_if(user_id, expected_status, new_status=UserStatus.IDLE):
+    """
+    Меняет статус, только если он все еще равен expected_status (например, поиск не закончился парой)
+    :return: True, если статус изменен
+    """
+    def run(c):
+        c.execute(SQL_RESET_SESSION, (new_status, user_id, expected_status))
+        return c.rowcount == 1
+
+    changed = await _write("reset_status_if", run)
+    if changed:
+        session_cache.put(user_id, new_status, None)
+    return changed
+
+async def get_partner_id(user_id):
+    """Возвращает ID партнера пользователя."""
+    session = await get_session(user_id)
+    return session[1] if session else None
+
+async def couple(current_user_id, other_user_id):
+    """
+    Соединяет двух пользователей в чате одной транзакцией.
+    Пара создается, только если оба пользователя все еще в поиске.
+    :return: True, если пользователи соединены
+    """
+    def run(c):
+        for user_id, partner_id in ((current_user_id, other_user_id), (other_user_id, current_user_id)):
+            c.execute(SQL_PAIR_USER, (UserStatus.COUPLED, partner_id, user_id, UserStatus.IN_SEARCH))
+            if c.rowcount != 1:
+                c.connection.rollback()
+                return False
+        return True
+
+    if not await _write("couple", run):
+        return False
+    session_cache.put(current_user_id, UserStatus.COUPLED, other_user_id)
+    session_cache.put(other_user_id, UserStatus.COUPLED, current_user_id)
+    return True
+
+async def uncouple(user_id):
+    """Разъединяет пользователя с его партнером."""
+    def run(c):
+        result = c.execute(SQL_GET_PARTNER, (user_id,)).fetchone()
+        partner_id = _to_id(result[0]) if result else None
+        if not partner_id:
+            return None
+        c.execute(SQL_SET_SESSION, (UserStatus.IDLE, None, user_id))
+        c.execute(SQL_SET_SESSION, (UserStatus.IDLE, None, partner_id))
+        return partner_id
+
+    partner_id = await _write("uncouple", run)
+    if partner_id:
+        session_cache.put(user_id, UserStatus.IDLE, None)
+        session_cache.put(partner_id, UserStatus.IDLE, None)
+
+async def insert_messages(rows):
+    """Записывает пачку сообщений (user_id, message_text, timestamp) одной транзакцией."""
+    await _write("insert_messages", lambda c: c.executemany(SQL_INSERT_MESSAGE, rows))
+
+async def retrieve_counters():
+    """Возвращает все счетчики статистики: {'users': .., 'messages': .., 'status:<статус>': ..}."""
+    return dict(await _read("retrieve_counters",
+                            lambda c: c.execute("SELECT name, value FROM stats_counters").fetchall()))
+
+async def retrieve_top_users(limit=1):
+    """Возвращает [(user_id, число сообщений)] самых активных пользователей (по индексу, без сортировки)."""
+    return await _read("retrieve_top_users", lambda c: c.execute(
+        "SELECT user_id, message_count FROM message_counts ORDER BY message_count DESC LIMIT ?",
+        (limit,)).fetchall())
+
+async def retrieve_users_number():
+    """Возвращает количество пользователей и количество пар."""
+    counters = await retrieve_counters()
+    return counters.get("users", 0), counters.get("status:" + UserStatus.COUPLED, 0)
+
+async def get_user_ids_by_status(status):
+    """Возвращает ID пользователей с данным статусом (по индексу idx_users_status)."""
+    rows = await _read("get_user_ids_by_status",
+                       lambda c: c.execute(SQL_GET_USERS_BY_STATUS, (status,)).fetchall())
+    return [row[0] for row in rows]
+
+async def get_search_criteria(user_id):
+    """Возвращает сохраненные критерии поиска собеседника: (язык или None, интересы)."""
+    result = await _read("get_search_criteria", lambda c: c.execute(SQL_GET_CRITERIA, (user_id,)).fetchone())
+    if result is None:
+        return None, ()
+    return result[0], _to_tags(result[1])
+
+async def set_search_criteria(user_id, language, tags):
+    """Сохраняет критерии поиска собеседника."""
+    await _write("set_search_criteria",
+                 lambda c: c.execute(SQL_SET_CRITERIA, (language, " ".join(tags) or None, user_id)))
+
+async def get_searching_users():
+    """Возвращает [(user_id, язык, интересы)] пользователей в поиске (для восстановления очереди)."""
+    rows = await _read("get_searching_users",
+                       lambda c: c.execute(SQL_GET_SEARCHING, (UserStatus.IN_SEARCH,)).fetchall())
+    return [(row[0], row[1], _to_tags(row[2])) for row in rows]
+
+async def get_user_ids_page(after_user_id, limit):
+    """
+    Возвращает следующую страницу ID пользователей по возрастанию (по первичному ключу, без OFFSET)
+    :param after_user_id: последний ID предыдущей страницы (0 - с начала)
+    :param limit: размер страницы
+    """
+    rows = await _read("get_user_ids_page",
+                       lambda c: c.execute(SQL_GET_USER_IDS_PAGE, (after_user_id, limit)).fetchall())
+    return [row[0] for row in rows]
+
+async def create_broadcast(text, admin_id):
+    """Сохраняет новую рассылку. Возвращает ее ID."""
+    return await _write("create_broadcast", lambda c: c.execute(
+        "INSERT INTO broadcasts (text, admin_id) VALUES (?, ?)", (text, admin_id)).lastrowid)
+
+async def save_broadcast_progress(broadcast_id, last_user_id, sent, failed, removed):
+    """Запоминает, до какого пользователя дошла рассылка."""
+    await _write("save_broadcast_progress",
+                 lambda c: c.execute(SQL_SAVE_BROADCAST, (last_user_id, sent, failed, removed, broadcast_id)))
+
+async def finish_broadcast(broadcast_id):
+    await _write("finish_broadcast", lambda c: c.execute(
+        "UPDATE broadcasts SET finished_at=CURRENT_TIMESTAMP WHERE id=?", (broadcast_id,)))
+
+async def get_unfinished_broadcasts():
+    """Возвращает незавершенные рассылки: [(id, text, admin_id, last_user_id, sent, failed, removed)]."""
+    return await _read("get_unfinished_broadcasts", lambda c: c.execute(
+        "SELECT id, text, admin_id, last_user_id, sent, failed, removed FROM broadcasts "
+        "WHERE finished_at IS NULL ORDER BY id").fetchall())
+
+async def get_oldest_message_time():
+    """Возвращает время самого старого сообщения с датой в таблице messages или None, если таких нет."""
+    row = await _read("get_oldest_message_time", lambda c: c.execute(SQL_OLDEST_MESSAGE).fetchone())
+    return row[0] if row else None
+
+async def attach_archive(path, alias):
+    """
+    Присоединяет файл архивного раздела к соединению для записи (и создает в нем таблицу messages)
+    :param path: путь к файлу раздела
+    :param alias: имя схемы раздела (генерируется retention.py, не пользовательский ввод)
+    """
+    def run(c):
+        c.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+        c.execute(f"""
+            CREATE TABLE IF NOT EXISTS {alias}.messages (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                message_text TEXT,
+                timestamp DATETIME
+            )""")
+        c.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_messages_user ON messages (user_id, timestamp)")
+    await _write("attach_archive", run)
+
+async def detach_archive(alias):
+    await _write("detach_archive", lambda c: c.execute(f"DETACH DATABASE {alias}"))
+
+async def copy_messages_to_archive(alias, month, before, limit):
+    """
+    Копирует самые старые сообщения месяца month (ГГГГ-ММ) с timestamp < before в присоединенный
+    раздел alias. Сообщения из таблицы не удаляются: это делает delete_archived_messages() следующей
+    транзакцией; повторное копирование после сбоя между ними пропускается по первичному ключу
+    :return: скопированные строки [(id, timestamp)] по возрастанию id
+    """
+    def run(c):
+        batch = []
+        for row in c.execute(SQL_MESSAGES_HEAD, (limit,)).fetchall():
+            if row[3] >= before or row[3][:7] != month:
+                break
+            batch.append(row)
+        c.executemany(f"INSERT OR IGNORE INTO {alias}.messages VALUES (?, ?, ?, ?)", batch)
+        return [(row[0], row[3]) for row in batch]
+    return await _write("copy_messages_to_archive", run)
+
+async def delete_archived_messages(month, path, rows):
+    """
+    Удаляет скопированные в архив сообщения и учитывает их в сводке (message_days, message_archive)
+    одной транзакцией. Удаляются по id: между ними могут быть строки без даты, которые не архивируются
+    :param rows: результат copy_messages_to_archive()
+    """
+    days = Counter(timestamp[:10] for _, timestamp in rows)
+
+    def run(c):
+        c.executemany(SQL_DELETE_MESSAGE, ((message_id,) for message_id, _ in rows))
+        c.executemany(SQL_COUNT_ARCHIVED_DAY, days.items())
+        c.execute(SQL_COUNT_ARCHIVED_MONTH, (month, path, len(rows), rows[0][1], rows[-1][1]))
+    await _write("delete_archived_messages", run)
+
+async def get_message_archive():
+    """Возвращает каталог архивных разделов: [(month, path, messages, first_at, last_at, sealed)]."""
+    return await _read("get_message_archive", lambda c: c.execute(
+        "SELECT month, path, messages, first_at, last_at, sealed FROM message_archive ORDER BY month").fetchall())
+
+async def seal_message_archive(month, path, sealed=True):
+    """Отмечает раздел как закрытый (сжатый) или снова открытый и запоминает новый путь к нему."""
+    await _write("seal_message_archive", lambda c: c.execute(
+        "UPDATE message_archive SET path=?, sealed=? WHERE month=?", (path, int(sealed), month)))
+
+async def incremental_vacuum(pages):
+    """
+    Возвращает файловой системе до pages свободных страниц (только при auto_vacuum=INCREMENTAL)
+    :return: сколько свободных страниц осталось
+    """
+    def run(c):
+        c.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        return c.execute("PRAGMA freelist_count").fetchone()[0]
+    return await _write("incremental_vacuum", run)
+
+async def retrieve_detailed_statistics():
+    counters = await retrieve_counters()
+    top_users = await retrieve_top_users(1)
+    total_messages = counters.get("messages", 0)
+    active_users = counters.get("status:" + UserStatus.IN_SEARCH, 0)
+    idle_users = counters.get("status:" + UserStatus.IDLE, 0)
+    most_active_user = top_users[0] if top_users else None
+    return total_messages, active_users, idle_users, most_active_user
@@ -0,0 +1,106 @@
+"""
+Локальный поддельный Bot API для нагрузочных тестов и проверки webhook без обращения к Telegram.
+Запуск: python fake_bot_api.py [порт]
+Затем указать в config.py BOT_API_URL = "http://127.0.0.1:<порт>/bot".
+"""
+import asyncio
+import itertools
+import json
+import sys
+import time
+from urllib.parse import parse_qsl
+import httpserver
+
+
+class FakeBotAPI:
+    """
+    Отвечает на методы Bot API, которые использует бот, и запоминает отправленные сообщения.
+    on_request(method, params) вызывается для каждого запроса - через него нагрузочный тест
+    измеряет задержку доставки.
+    """
+
+    def __init__(self, on_request=None, latency=0.0):
+        self.on_request = on_request
+        self.latency = latency
+        self.calls = {}
+        self.updates = asyncio.Queue()
+        self.webhook_url = None
+        self._message_ids = itertools.count(1)
+        self._server = None
+        self.port = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server, self.port = await httpserver.serve(self._handle, host, port)
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def _message(self, chat_id, **fields):
+        return dict(message_id=next(self._message_ids), date=int(time.time()),
+                    chat={"id": int(chat_id), "type": "private"}, **fields)
+
+    async def _handle(self, request):
+        # Путь: /bot<токен>/<метод>
+        method = request.path.rsplit("/", 1)[-1]
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            params = json.loads(request.body or b"{}")
+        else:
+            params = dict(parse_qsl(request.body.decode()))
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.on_request is not None:
+            self.on_request(method, params)
+        result = await self._dispatch(method, params)
+        body = json.dumps({"ok": True, "result": result}).encode()
+        return 200, "application/json", body
+
+    async def _dispatch(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot",
+                    "can_join_groups": False, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if method == "sendMessage":
+            return self._message(params["chat_id"], text=params.get("text", ""))
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method == "copyMessages":
+            return [{"message_id": next(self._message_ids)} for _ in json.loads(params["message_ids"])]
+        if method == "getUpdates":
+            timeout = float(params.get("timeout", 0))
+            updates = []
+            try:
+                updates.append(await asyncio.wait_for(self.updates.get(), timeout=timeout or 0.01))
+                while not self.updates.empty():
+                    updates.append(self.updates.get_nowait())
+            except asyncio.TimeoutError:
+                pass
+            return updates
+        if method == "setWebhook":
+            self.webhook_url = params.get("url")
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url or "", "has_custom_certificate": False, "pending_update_count": 0}
+        # Остальные методы (setMyCommands, close, logOut, ...) просто подтверждаются
+        return True
+
+
+async def main(port):
+    api = await FakeBotAPI(on_request=lambda method, params: print(method, params)).start(port=port)
+    print(f"Поддельный Bot API: {api.base_url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 8081))
@@ -0,0 +1,46 @@
+"""
+Локальный поддельный сервер Dialogflow для проверки чата с ИИ без обращения к Google.
+Запуск: python fake_dialogflow.py [порт] [задержка_в_секундах]
+Затем указать в config.py DIALOGFLOW_ENDPOINT = "localhost:<порт>".
+"""
+import sys
+import time
+from concurrent import futures
+import grpc
+from google.cloud import dialogflow
+
+
+def make_server(port=50051, delay=0.0, reply=lambda text: f"Эхо: {text}"):
+    """
+    Создает gRPC сервер, отвечающий на DetectIntent
+    :param port: порт (0 - выбрать свободный, см. server.port)
+    :param delay: искусственная задержка ответа в секундах
+    :param reply: функция, формирующая ответ по тексту запроса
+    :return: запущенный сервер
+    """
+    def detect_intent(request, context):
+        if delay:
+            time.sleep(delay)
+        result = dialogflow.QueryResult(query_text=request.query_input.text.text,
+                                        fulfillment_text=reply(request.query_input.text.text))
+        return dialogflow.DetectIntentResponse(query_result=result)
+
+    handler = grpc.method_handlers_generic_handler("google.cloud.dialogflow.v2.Sessions", {
+        "DetectIntent": grpc.unary_unary_rpc_method_handler(
+            detect_intent,
+            request_deserializer=dialogflow.DetectIntentRequest.deserialize,
+            response_serializer=dialogflow.DetectIntentResponse.serialize),
+    })
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
+    server.add_generic_rpc_handlers((handler,))
+    server.port = server.add_insecure_port(f"localhost:{port}")
+    server.start()
+    return server
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 50051
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    server = make_server(port, delay)
+    print(f"Поддельный Dialogflow слушает localhost:{server.port}")
+    server.wait_for_termination()
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 413: "Payload Too Large",
+           429: "Too Many Requests", 500: "Internal Server Error"}
+MAX_BODY = 1024 * 1024  # байт в теле запроса
+MAX_HEADERS = 100
+READ_TIMEOUT = 30.0  # секунд на получение запроса целиком
+
+
+class Request:
+    __slots__ = ("method", "path", "headers", "body")
+
+    def __init__(self, method, path, headers, body):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+
+class HTTPError(Exception):
+    """Запрос отклонен до вызова обработчика: ответить status и закрыть соединение."""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+async def _read_request(reader, max_body, authorize):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise HTTPError(400)
+    method, path, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, colon, value = line.decode("latin-1").partition(":")
+        if not colon or len(headers) >= MAX_HEADERS:
+            raise HTTPError(400)
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(400)
+    if length < 0:
+        raise HTTPError(400)
+    if length > max_body:
+        raise HTTPError(413)
+    # Проверка до чтения тела: чужие запросы не заставляют сервер принимать мегабайты
+    if authorize is not None:
+        status = authorize(method, path, headers)
+        if status is not None:
+            raise HTTPError(status)
+    body = await reader.readexactly(length) if length else b""
+    return Request(method, path, headers, body)
+
+
+def _respond(writer, status, content_type, body):
+    writer.write(
+        f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+
+
+async def serve(handler, host="127.0.0.1", port=0, authorize=None, max_body=MAX_BODY, timeout=READ_TIMEOUT):
+    """
+    Запускает минимальный HTTP/1.1 сервер (keep-alive, тело по Content-Length).
+    Нужен для служебных задач: поддельного Bot API, метрик, приема webhook в многопроцессном режиме.
+    Некорректный запрос получает 400, слишком большое тело - 413; соединение, которое не прислало
+    запрос за timeout секунд, закрывается.
+    :param handler: корутина handler(request) -> (status, content_type, body_bytes)
+    :param host: адрес
+    :param port: порт (0 - выбрать свободный)
+    :param authorize: функция authorize(method, path, headers) -> None или код ответа; вызывается до чтения тела
+    :param max_body: максимальный размер тела в байтах
+    :param timeout: сколько секунд ждать запрос целиком (строку, заголовки и тело)
+    :return: (asyncio.Server, фактический порт)
+    """
+    async def on_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader, max_body, authorize), timeout)
+                except HTTPError as e:
+                    _respond(writer, e.status, "text/plain", REASONS.get(e.status, "").encode())
+                    await writer.drain()
+                    break
+                except ValueError:
+                    # Строка длиннее лимита StreamReader
+                    _respond(writer, 400, "text/plain", b"Bad Request")
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                try:
+                    status, content_type, body = await handler(request)
+                except Exception as e:
+                    logging.error("Ошибка HTTP обработчика %s: %s", request.path, e)
+                    status, content_type, body = 500, "text/plain", str(e).encode()
+                _respond(writer, status, content_type, body)
+                await writer.drain()
+                if request.headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(on_connection, host, port)
+    return server, server.sockets[0].getsockname()[1]
@@ -0,0 +1,317 @@
+"""
+Нагрузочный тест: поддельный Bot API + тысячи смоделированных пользователей.
+Прогоняет /start, /chat, пересылку сообщений, /exit и /newchat и выводит задержки
+пересылки (p50/p99), скорость соединения пар, число запросов к базе данных и задержку
+цикла событий. Результат сохраняется в JSON, чтобы сравнивать коммиты между собой:
+
+    python loadtest.py --users 10000 --messages 5 --output before.json
+    python loadtest.py --users 10000 --messages 5 --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+from telegram import Update
+import bot
+import db_connection
+from fake_bot_api import FakeBotAPI
+from sender import scheduler
+from relay import relay
+
+PAIRED_TEXT = "🤖 Вы были соединены с пользователем"
+WELCOME_PREFIX = "Добро пожаловать"
+LEFT_TEXT = "🤖 Вы покинули чат."
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Counter:
+    """Счетчик с ожиданием достижения значения."""
+
+    def __init__(self):
+        self.value = 0
+        self._waiters = []
+
+    def add(self, n=1):
+        self.value += n
+        for target, event in self._waiters:
+            if self.value >= target:
+                event.set()
+
+    async def wait_for(self, target, timeout):
+        if self.value >= target:
+            return True
+        event = asyncio.Event()
+        self._waiters.append((target, event))
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters.remove((target, event))
+
+
+class LoopLagMonitor:
+    """Измеряет, насколько позже запланированного просыпается задача (задержка цикла событий)."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - started - self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+async def start_api_thread(on_request):
+    """
+    Запускает поддельный Bot API в отдельном потоке со своим циклом событий, чтобы его работа
+    не попадала в измеряемую задержку цикла событий бота. on_request(method, params, время_получения)
+    вызывается в цикле событий бота.
+    """
+    bot_loop = asyncio.get_running_loop()
+    api_loop = asyncio.new_event_loop()
+    threading.Thread(target=api_loop.run_forever, daemon=True).start()
+
+    def forward(method, params):
+        bot_loop.call_soon_threadsafe(on_request, method, params, time.perf_counter())
+
+    async def create():
+        return await FakeBotAPI(on_request=forward).start()
+
+    api = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(create(), api_loop))
+    return api, api_loop
+
+
+class LoadTest:
+    def __init__(self, users, messages, timeout):
+        self.user_ids = list(range(1_000_000, 1_000_000 + users))
+        self.messages = messages
+        self.timeout = timeout
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.sent_at = {}
+        self.relay_latencies = []
+        self.welcomes = Counter()
+        self.paired = Counter()
+        self.relayed = Counter()
+        self.left = Counter()
+        self.application = None
+
+    def on_request(self, method, params, now):
+        if method == "copyMessage":
+            sent_at = self.sent_at.pop((int(params["from_chat_id"]), int(params["message_id"])), None)
+            if sent_at is not None:
+                self.relay_latencies.append(now - sent_at)
+            self.relayed.add()
+        elif method == "copyMessages":
+            # Пачка (альбом или серия сообщений): задержка считается для каждого сообщения
+            message_ids = json.loads(params["message_ids"])
+            for message_id in message_ids:
+                sent_at = self.sent_at.pop((int(params["from_chat_id"]), message_id), None)
+                if sent_at is not None:
+                    self.relay_latencies.append(now - sent_at)
+            self.relayed.add(len(message_ids))
+        elif method == "sendMessage":
+            text = params.get("text", "")
+            if text.startswith(WELCOME_PREFIX):
+                self.welcomes.add()
+            elif text == PAIRED_TEXT:
+                self.paired.add()
+            elif text == LEFT_TEXT:
+                self.left.add()
+
+    def make_update(self, user_id, text):
+        message_id = next(self._message_ids)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        update = Update.de_json({"update_id": next(self._update_ids), "message": message}, self.application.bot)
+        return update, message_id
+
+    async def feed(self, user_ids, text):
+        for user_id in user_ids:
+            update, message_id = self.make_update(user_id, text)
+            self.sent_at[(user_id, message_id)] = time.perf_counter()
+            await self.application.update_queue.put(update)
+
+    async def phase(self, name, results, coro):
+        queries_before = dict(db_connection.query_counts)
+        started = time.perf_counter()
+        ok = await coro
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            "completed": ok,
+            "seconds": round(elapsed, 4),
+            "db_reads": db_connection.query_counts["read"] - queries_before["read"],
+            "db_writes": db_connection.query_counts["write"] - queries_before["write"],
+        }
+        logging.warning("Фаза %s: %.2f с%s", name, elapsed, "" if ok else " (таймаут!)")
+        return results[name]
+
+    async def run_start(self):
+        await self.feed(self.user_ids, "/start")
+        return await self.welcomes.wait_for(len(self.user_ids), self.timeout)
+
+    async def run_chat(self):
+        await self.feed(self.user_ids, "/chat")
+        return await self.paired.wait_for(len(self.user_ids) // 2 * 2, self.timeout)
+
+    async def run_relay(self, coupled):
+        target = 0
+        for i in range(self.messages):
+            await self.feed(coupled, f"сообщение {i}")
+            target += len(coupled)
+        return await self.relayed.wait_for(target, self.timeout)
+
+    async def run_exit(self, pairs):
+        # Из половины пар один собеседник выходит (/exit), из другой - ищет нового (/newchat)
+        leaving = [user_id for user_id, _ in pairs[::2]]
+        renewing = [user_id for user_id, _ in pairs[1::2]]
+        await self.feed(leaving, "/exit")
+        await self.feed(renewing, "/newchat")
+        return await self.left.wait_for(len(leaving) + len(renewing), self.timeout)
+
+    async def run(self):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="botik-loadtest-"), "loadtest.db")
+        api, api_loop = await start_api_thread(self.on_request)
+        await db_connection.init(db_path)
+        bot.METRICS_PORT = None
+        self.application = bot.build_application(token="123456:LOADTEST", base_url=api.base_url)
+        await self.application.initialize()
+        await self.application.post_init(self.application)
+        # Измеряем сам бот, а не лимиты Telegram
+        scheduler.set_limits(global_rate=1e9, global_burst=1e9, chat_rate=1e9, chat_burst=1e9)
+        relay.user_rate = relay.user_burst = 1e9
+        await self.application.start()
+
+        lag = LoopLagMonitor()
+        lag.start()
+        phases = {}
+        try:
+            await self.phase("start", phases, self.run_start())
+            result = await self.phase("chat", phases, self.run_chat())
+            result["pairs_per_second"] = round(self.paired.value / 2 / result["seconds"], 1)
+            coupled, pairs = [], []
+            for user_id in self.user_ids:
+                partner_id = await db_connection.get_partner_id(user_id)
+                if partner_id is not None:
+                    coupled.append(user_id)
+                    if user_id < partner_id:
+                        pairs.append((user_id, partner_id))
+            result = await self.phase("relay", phases, self.run_relay(coupled))
+            result["messages_per_second"] = round(self.relayed.value / result["seconds"], 1)
+            result["db_queries_per_message"] = round(
+                (result["db_reads"] + result["db_writes"]) / max(1, self.relayed.value), 4)
+            await self.phase("exit", phases, self.run_exit(pairs))
+        finally:
+            lag.stop()
+            await self.application.stop()
+            # Как run_polling: досылка сообщений до закрытия клиента Bot API
+            await self.application.post_stop(self.application)
+            await self.application.shutdown()
+            await self.application.post_shutdown(self.application)
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(api.stop(), api_loop))
+            api_loop.call_soon_threadsafe(api_loop.stop)
+
+        ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+        return {
+            "users": len(self.user_ids),
+            "messages_per_user": self.messages,
+            "phases": phases,
+            "relay_latency_ms": {
+                "p50": ms(percentile(self.relay_latencies, 0.50)),
+                "p99": ms(percentile(self.relay_latencies, 0.99)),
+                "max": ms(max(self.relay_latencies, default=None)),
+                "mean": ms(statistics.fmean(self.relay_latencies)) if self.relay_latencies else None,
+            },
+            "event_loop_lag_ms": {
+                "p50": ms(percentile(lag.samples, 0.50)),
+                "p99": ms(percentile(lag.samples, 0.99)),
+                "max": ms(max(lag.samples, default=None)),
+            },
+            "api_calls": api.calls,
+            "session_cache": db_connection.session_cache.stats(),
+        }
+
+
+# Метрики, где рост значения означает ухудшение
+LOWER_IS_BETTER = [
+    ("relay_latency_ms", "p50"), ("relay_latency_ms", "p99"),
+    ("event_loop_lag_ms", "p99"),
+    ("phases", "start", "seconds"), ("phases", "chat", "seconds"), ("phases", "relay", "seconds"),
+    ("phases", "relay", "db_queries_per_message"),
+]
+
+
+def compare(current, previous, tolerance):
+    """Печатает изменения относительно прошлого прогона. Возвращает число регрессий."""
+    regressions = 0
+    for path in LOWER_IS_BETTER:
+        old, new = previous, current
+        for key in path:
+            old = old.get(key) if isinstance(old, dict) else None
+            new = new.get(key) if isinstance(new, dict) else None
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        flag = ""
+        if change > tolerance:
+            flag = "  <-- РЕГРЕССИЯ"
+            regressions += 1
+        print(f"{'.'.join(path):40} {old:>12} -> {new:>12} ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с поддельным Bot API")
+    parser.add_argument("--users", type=int, default=2000, help="число смоделированных пользователей")
+    parser.add_argument("--messages", type=int, default=5, help="сообщений от каждого пользователя в паре")
+    parser.add_argument("--timeout", type=float, default=120.0, help="таймаут одной фазы в секундах")
+    parser.add_argument("--output", help="куда сохранить результат (JSON)")
+    parser.add_argument("--compare", help="результат прошлого прогона (JSON) для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="допустимое ухудшение (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    report = asyncio.run(LoadTest(args.users, args.messages, args.timeout).run())
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        if compare(report, previous, args.tolerance):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
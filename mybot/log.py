@@ -1,20 +1,44 @@
-from google.cloud import dialogflow_v2 as dialogflow
-
-
-def test_dialogflow_intent():
-    # Настройка клиента
-    session_client = dialogflow.SessionsClient.from_service_account_json("small-talk-qpp9-01bbaad3cc34.json")
-    session = session_client.session_path("small-talk-qpp9", "test-session-id")
-
-    # Пример текста
-    text_input = dialogflow.TextInput(text="Привет", language_code="ru")
-    query_input = dialogflow.QueryInput(text=text_input)
-
-    # Отправка запроса в Dialogflow
-    response = session_client.detect_intent(session=session, query_input=query_input)
-
-    # Ответ от Dialogflow
-    print("Ответ от Dialogflow:", response.query_result.fulfillment_text)
-
-
-test_dialogflow_intent()
+"""
+Проверка бэкенда чата с ИИ (config.AI_BACKEND): отправляет одну фразу и выводит ответ
+и время запроса. Выполняется только при явном запуске:
+
+    python log.py [фраза]
+"""
+import asyncio
+import logging
+import sys
+import time
+from ai_backend import LazyBackend
+
+
+async def test_dialogflow_intent(text="Привет"):
+    """
+    Отправляет фразу бэкенду дважды: первый запрос включает загрузку бэкенда, второй - только запрос
+    :param text: текст запроса
+    :return: True, если бэкенд ответил
+    """
+    backend = LazyBackend()
+    print("Бэкенд:", backend.path)
+    try:
+        started = time.perf_counter()
+        response = await backend.detect_intent("test-session-id", text)
+        first = time.perf_counter() - started
+        if response is None:
+            print("Бэкенд не ответил (подробности в логе выше).")
+            return False
+        started = time.perf_counter()
+        await backend.detect_intent("test-session-id", text)
+        second = time.perf_counter() - started
+    finally:
+        backend.close()
+
+    print("Запрос:", text)
+    print("Ответ:", response)
+    print(f"Загрузка и первый запрос: {first:.2f} с, повторный запрос: {second:.2f} с")
+    return True
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(levelname)s - %(message)s', level=logging.WARNING)
+    ok = asyncio.run(test_dialogflow_intent(" ".join(sys.argv[1:]) or "Привет"))
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,209 @@
+import asyncio
+from collections import OrderedDict
+import logging
+from UserStatus import UserStatus
+from config import MATCH_FALLBACK_WAIT
+import db_connection
+
+
+class MatchQueue:
+    """
+    FIFO очередь пользователей, ожидающих собеседника.
+    Добавление, извлечение первого и отмена выполняются за O(1).
+    """
+
+    def __init__(self):
+        self._waiting = OrderedDict()
+
+    def __len__(self):
+        return len(self._waiting)
+
+    def __contains__(self, user_id):
+        return user_id in self._waiting
+
+    def push(self, user_id):
+        """Ставит пользователя в конец очереди (повторная постановка не меняет его место)."""
+        self._waiting.setdefault(user_id, None)
+
+    def push_front(self, user_id):
+        """Возвращает пользователя в начало очереди."""
+        self._waiting[user_id] = None
+        self._waiting.move_to_end(user_id, last=False)
+
+    def pop(self):
+        """Извлекает пользователя, который ждет дольше всех, или None, если очередь пуста."""
+        if not self._waiting:
+            return None
+        user_id, _ = self._waiting.popitem(last=False)
+        return user_id
+
+    def cancel(self, user_id):
+        """Убирает пользователя из очереди. Возвращает True, если он там был."""
+        return self._waiting.pop(user_id, False) is None
+
+
+def bucket_levels(language, tags):
+    """
+    Корзины, в которых ищется собеседник, от самых точных к самым широким.
+    Корзина - пара (язык, интерес); None означает "любой".
+    :return: список уровней, каждый уровень - список корзин
+    """
+    levels = []
+    if tags:
+        levels.append([(language, tag) for tag in tags])
+    levels.append([(language, None)])
+    if language is not None:
+        levels.append([(None, None)])
+    return levels
+
+
+class _Search:
+    """Пользователь в поиске: его корзины и текущий уровень расширения поиска."""
+    __slots__ = ("levels", "level", "timer")
+
+    def __init__(self, language, tags):
+        self.levels = bucket_levels(language, tags)
+        self.level = 0
+        self.timer = None
+
+    def buckets(self):
+        """Корзины всех уровней до текущего, от точных к широким."""
+        return [key for level in self.levels[:self.level + 1] for key in level]
+
+
+class Matchmaker:
+    """
+    Подбирает собеседников по языку и интересам.
+    Для каждой корзины (язык, интерес) своя очередь; пользователь стоит в очередях всех своих
+    корзин, а после fallback_wait секунд без собеседника переходит в более широкие: сначала
+    "тот же язык, любые интересы", затем "кто угодно". Поиск проверяет только первых в очередях
+    своих корзин, поэтому его стоимость не зависит от числа ожидающих пользователей.
+    Извлечение из очереди синхронно (между ним и выбором партнера нет await), поэтому два
+    одновременных /chat не могут получить одного и того же ожидающего пользователя.
+    Пара записывается в базу данных одной транзакцией.
+    """
+
+    def __init__(self, fallback_wait=MATCH_FALLBACK_WAIT):
+        self.fallback_wait = fallback_wait
+        # Корутина on_match(user_id, partner_id): уведомить пару, найденную при расширении поиска
+        self.on_match = None
+        self._buckets = {}  # (язык, интерес) -> MatchQueue
+        self._searches = {}  # user_id -> _Search
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._searches)
+
+    def __contains__(self, user_id):
+        return user_id in self._searches
+
+    async def restore(self):
+        """Восстанавливает очередь после перезапуска по статусам IN_SEARCH в базе данных."""
+        for user_id, language, tags in await db_connection.get_searching_users():
+            search = self._searches[user_id] = _Search(language, tags)
+            self._enqueue(user_id, search)
+
+    async def find_partner(self, user_id, language=None, tags=()):
+        """
+        Соединяет пользователя с тем, кто дольше всех ждет в его корзинах, или ставит его в очередь
+        :param user_id: ID пользователя в статусе IN_SEARCH
+        :param language: язык собеседника или None
+        :param tags: интересы
+        :return: ID партнера или None, если пользователь поставлен в очередь
+        """
+        self.cancel(user_id)
+        search = self._searches[user_id] = _Search(language, tags)
+        return await self._match(user_id, search)
+
+    def cancel(self, user_id):
+        """Убирает пользователя из очереди ожидания."""
+        search = self._searches.pop(user_id, None)
+        if search is not None:
+            self._detach(user_id, search)
+
+    async def _match(self, user_id, search):
+        while True:
+            other_user_id = self._pop(search)
+            if other_user_id is None:
+                # Пока шла запись в базу данных, пользователь мог отменить поиск
+                if self._searches.get(user_id) is search:
+                    self._enqueue(user_id, search)
+                return None
+            if await db_connection.couple(user_id, other_user_id):
+                self._forget(user_id)
+                self._forget(other_user_id)
+                return other_user_id
+            # Один из пользователей уже не в поиске (вышел, заблокировал бота и т.п.)
+            logging.debug("Не удалось соединить %s и %s.", user_id, other_user_id)
+            if await db_connection.get_user_status(other_user_id) == UserStatus.IN_SEARCH:
+                # Поиск прекратил сам пользователь: вернуть партнера на его место в очереди
+                other_search = self._searches.get(other_user_id)
+                if other_search is not None:
+                    self._enqueue(other_user_id, other_search, front=True)
+                self._forget(user_id)
+                return None
+            self._forget(other_user_id)
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = MatchQueue()
+        return bucket
+
+    def _pop(self, search):
+        """Извлекает первого ожидающего из самой точной непустой корзины и убирает его из остальных."""
+        for key in search.buckets():
+            bucket = self._buckets.get(key)
+            if bucket:
+                other_user_id = bucket.pop()
+                if not bucket:
+                    del self._buckets[key]
+                self._detach(other_user_id, self._searches[other_user_id])
+                return other_user_id
+        return None
+
+    def _enqueue(self, user_id, search, front=False):
+        for key in search.buckets():
+            if front:
+                self._bucket(key).push_front(user_id)
+            else:
+                self._bucket(key).push(user_id)
+        if search.level + 1 < len(search.levels):
+            search.timer = asyncio.get_running_loop().call_later(self.fallback_wait, self._start_widen, user_id)
+
+    def _detach(self, user_id, search):
+        if search.timer is not None:
+            search.timer.cancel()
+            search.timer = None
+        for key in search.buckets():
+            bucket = self._buckets.get(key)
+            if bucket is not None and bucket.cancel(user_id) and not bucket:
+                del self._buckets[key]
+
+    def _forget(self, user_id):
+        search = self._searches.pop(user_id, None)
+        if search is not None:
+            self._detach(user_id, search)
+
+    def _start_widen(self, user_id):
+        task = asyncio.create_task(self._widen(user_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _widen(self, user_id):
+        """Переводит долго ждущего пользователя в более широкие корзины и ищет там собеседника."""
+        search = self._searches.get(user_id)
+        if search is None:
+            return
+        search.timer = None
+        self._detach(user_id, search)
+        search.level += 1
+        try:
+            other_user_id = await self._match(user_id, search)
+            if other_user_id is not None and self.on_match is not None:
+                await self.on_match(user_id, other_user_id)
+        except Exception as e:
+            logging.error("Ошибка при расширении поиска для %s: %s", user_id, e)
+
+
+matchmaker = Matchmaker()
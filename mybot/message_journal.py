@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from config import JOURNAL_BATCH_SIZE, JOURNAL_FLUSH_INTERVAL, JOURNAL_MAX_BUFFER
+import db_connection
+import metrics
+
+
+class MessageJournal:
+    """
+    Журнал сообщений с групповой фиксацией.
+    record() только добавляет строку в буфер; фоновая задача сбрасывает буфер в таблицу
+    messages одной транзакцией executemany, когда набирается batch_size строк
+    или проходит flush_interval секунд.
+    Если база недоступна, буфер растет не больше max_buffer строк: дальше отбрасываются самые старые.
+    """
+
+    def __init__(self, batch_size=JOURNAL_BATCH_SIZE, flush_interval=JOURNAL_FLUSH_INTERVAL,
+                 max_buffer=JOURNAL_MAX_BUFFER):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._dropped = 0  # отброшено строк с последней успешной записи
+        self._full = asyncio.Event()
+        self._task = None
+
+    def record(self, user_id, message_text):
+        """Добавляет сообщение в буфер. Не обращается к базе данных."""
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        self._buffer.append((user_id, message_text, timestamp))
+        self._trim()
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+
+    async def flush(self):
+        """Записывает все накопленные сообщения одной транзакцией."""
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        try:
+            await db_connection.insert_messages(rows)
+        except Exception as e:
+            logging.error("Ошибка при записи журнала сообщений (%s строк): %s", len(rows), e)
+            # Вернуть строки в начало буфера, чтобы записать их при следующей попытке
+            self._buffer[:0] = rows
+            self._trim()
+            return
+        if self._dropped:
+            logging.warning("Журнал сообщений снова записывается; потеряно %s строк.", self._dropped)
+            self._dropped = 0
+
+    def _trim(self):
+        """Отбрасывает самые старые строки сверх max_buffer."""
+        excess = len(self._buffer) - self.max_buffer
+        if excess <= 0:
+            return
+        del self._buffer[:excess]
+        if not self._dropped:
+            logging.warning("Буфер журнала сообщений заполнен (%s строк): самые старые строки отбрасываются.",
+                            self.max_buffer)
+        self._dropped += excess
+        metrics.registry.counter("bot_journal_dropped_total").inc(excess)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    def start(self):
+        """Запускает фоновую задачу сброса буфера."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую задачу и записывает остаток буфера."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+journal = MessageJournal()
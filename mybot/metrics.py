@@ -0,0 +1,155 @@
+"""
+Встроенные метрики: гистограммы задержек и счетчики, отдаваемые по HTTP в формате Prometheus.
+Запись метрики - это perf_counter, bisect и сложение, поэтому их можно держать включенными
+под полной нагрузкой.
+"""
+import functools
+import logging
+import time
+from bisect import bisect_left
+import httpserver
+
+# Границы корзин гистограмм задержек в секундах
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}  # (тип, имя) -> {метки: объект}
+        self._help = {}
+        self._gauges = {}  # имя -> функция, возвращающая {метки: значение}
+
+    def _get(self, kind, factory, name, labels):
+        series = self._metrics.get((kind, name))
+        if series is None:
+            series = self._metrics[(kind, name)] = {}
+        key = tuple(sorted(labels.items()))
+        metric = series.get(key)
+        if metric is None:
+            metric = series[key] = factory()
+        return metric
+
+    def histogram(self, name, **labels):
+        return self._get("histogram", Histogram, name, labels)
+
+    def counter(self, name, **labels):
+        return self._get("counter", Counter, name, labels)
+
+    def gauge(self, name, callback, help_text=""):
+        """Регистрирует значение, вычисляемое в момент запроса метрик: callback() -> {метки(tuple): число}."""
+        self._gauges[name] = callback
+        self.describe(name, help_text)
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus."""
+        lines = []
+
+        def header(name, kind):
+            if self._help.get(name):
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (kind, name), series in sorted(self._metrics.items()):
+            header(name, kind)
+            for key, metric in sorted(series.items()):
+                if kind == "counter":
+                    lines.append(f"{name}{_labels(key)} {metric.value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), metric.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(key)} {metric.sum}")
+                lines.append(f"{name}_count{_labels(key)} {metric.count}")
+        for name, callback in sorted(self._gauges.items()):
+            header(name, "gauge")
+            for key, value in sorted(callback().items()):
+                lines.append(f"{name}{_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+
+registry = Registry()
+registry.describe("bot_handler_seconds", "Время обработки обновления обработчиком")
+registry.describe("bot_handler_errors_total", "Исключения в обработчиках")
+registry.describe("bot_db_query_seconds", "Время запроса к базе данных (включая ожидание соединения)")
+registry.describe("bot_api_request_seconds", "Время запроса к Bot API")
+registry.describe("bot_api_calls_total", "Запросы к Bot API")
+registry.describe("bot_api_errors_total", "Ошибки запросов к Bot API")
+registry.describe("bot_ai_request_seconds", "Время запроса к Dialogflow")
+registry.describe("bot_ai_backend_load_seconds", "Время загрузки бэкенда ИИ при первом входе в чат с ИИ")
+registry.describe("bot_ai_answers_total", "Ответы в чате с ИИ по источнику (intent, cache, dialogflow)")
+registry.describe("bot_ai_answer_seconds", "Время ответа в чате с ИИ по источнику")
+registry.describe("bot_relay_messages_total", "Сообщения, поставленные в очередь пересылки собеседнику")
+registry.describe("bot_relay_requests_total", "Запросы copyMessage/copyMessages для пересылки")
+registry.describe("bot_relay_dropped_total", "Сообщения, не пересланные собеседнику (flood - лимит отправителя, unreachable - получатель недоступен)")
+registry.describe("bot_broadcast_messages_total", "Сообщения рассылок по результату")
+registry.describe("bot_reaped_sessions_total", "Поиски и чаты, завершенные из-за неактивности")
+registry.describe("bot_archived_messages_total", "Сообщения, перенесенные из таблицы messages в архив")
+
+
+def timed(callback):
+    """Оборачивает асинхронный обработчик, записывая время его работы и исключения."""
+    histogram = registry.histogram("bot_handler_seconds", handler=callback.__name__)
+    errors = registry.counter("bot_handler_errors_total", handler=callback.__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+
+async def start_server(port, host="127.0.0.1"):
+    """Запускает HTTP endpoint /metrics. None - порт занят (бот работает без endpoint)."""
+    async def handle(request):
+        if request.path.split("?", 1)[0] != "/metrics":
+            return 404, "text/plain", b"not found"
+        return 200, "text/plain; version=0.0.4; charset=utf-8", registry.render().encode()
+
+    try:
+        server, port = await httpserver.serve(handle, host, port)
+    except OSError as e:
+        logging.error("Не удалось запустить endpoint метрик на %s:%s: %s", host, port, e)
+        return None
+    logging.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return server
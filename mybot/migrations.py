@@ -0,0 +1,197 @@
+"""
+Версионированные миграции схемы базы данных.
+Текущая версия хранится в PRAGMA user_version; каждая миграция выполняется в своей транзакции
+и обновляет существующую базу на месте. Проверка версии без запуска бота:
+
+    python migrations.py [путь_к_базе]
+"""
+import logging
+import sqlite3
+import sys
+
+
+def _v1_base_tables(c):
+    """Исходные таблицы пользователей и сообщений."""
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            status TEXT,
+            partner_id TEXT
+        );
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            message_text TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+
+# Счетчики для /stats поддерживаются триггерами при каждом изменении users и messages,
+# поэтому статистика читается за постоянное время, без COUNT(*) по всей таблице.
+def _counter_upsert(name, delta):
+    return (f"INSERT INTO stats_counters (name, value) VALUES ({name}, {delta}) "
+            f"ON CONFLICT(name) DO UPDATE SET value = value + ({delta});")
+
+STATS_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS stats_user_insert AFTER INSERT ON users BEGIN
+        {_counter_upsert("'users'", 1)}
+        {_counter_upsert("'status:' || NEW.status", 1)}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_user_delete AFTER DELETE ON users BEGIN
+        {_counter_upsert("'users'", -1)}
+        {_counter_upsert("'status:' || OLD.status", -1)}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_user_status AFTER UPDATE OF status ON users
+    WHEN OLD.status IS NOT NEW.status BEGIN
+        {_counter_upsert("'status:' || OLD.status", -1)}
+        {_counter_upsert("'status:' || NEW.status", 1)}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_message_insert AFTER INSERT ON messages BEGIN
+        {_counter_upsert("'messages'", 1)}
+        INSERT INTO message_counts (user_id, message_count) VALUES (NEW.user_id, 1)
+            ON CONFLICT(user_id) DO UPDATE SET message_count = message_count + 1;
+    END""",
+]
+USER_TRIGGERS = ["stats_user_insert", "stats_user_delete", "stats_user_status"]
+
+
+def _v2_stats_tables(c):
+    """Сводные таблицы статистики; один раз заполняются по существующим данным."""
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='stats_counters'").fetchone()
+    c.execute("CREATE TABLE IF NOT EXISTS stats_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS message_counts (
+            user_id INTEGER PRIMARY KEY,
+            message_count INTEGER NOT NULL
+        );
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_message_counts_count ON message_counts (message_count)")
+    if not exists:
+        c.execute("INSERT INTO stats_counters SELECT 'users', COUNT(*) FROM users")
+        c.execute("INSERT INTO stats_counters SELECT 'status:' || status, COUNT(*) FROM users GROUP BY status")
+        c.execute("INSERT INTO stats_counters SELECT 'messages', COUNT(*) FROM messages")
+        c.execute("INSERT INTO message_counts SELECT user_id, COUNT(*) FROM messages GROUP BY user_id")
+    for trigger in STATS_TRIGGERS:
+        c.execute(trigger)
+
+
+def _v3_integer_keys(c):
+    """
+    users.user_id и partner_id хранились как TEXT, а обработчики передают int: каждый поиск
+    по ключу шел с преобразованием типов. Таблица пересоздается с INTEGER ключами.
+    """
+    # Триггеры статистики удаляются вместе с таблицей; данные не меняются, поэтому счетчики
+    # остаются верными, а триггеры создаются заново
+    for trigger in USER_TRIGGERS:
+        c.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    c.execute("""
+        CREATE TABLE users_new (
+            user_id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL,
+            partner_id INTEGER
+        );
+    """)
+    c.execute("""
+        INSERT INTO users_new (user_id, status, partner_id)
+        SELECT CAST(user_id AS INTEGER), COALESCE(status, 'idle'), CAST(partner_id AS INTEGER) FROM users
+    """)
+    c.execute("DROP TABLE users")
+    c.execute("ALTER TABLE users_new RENAME TO users")
+    c.execute("UPDATE messages SET user_id = CAST(user_id AS INTEGER) WHERE typeof(user_id) != 'integer'")
+    for trigger in STATS_TRIGGERS:
+        c.execute(trigger)
+
+
+def _v4_indexes(c):
+    """Покрывающие индексы для выборок по статусу/партнеру и по сообщениям пользователя."""
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_status ON users (status, user_id, partner_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_user ON messages (user_id, timestamp)")
+
+
+def _v5_search_criteria(c):
+    """Критерии поиска собеседника: язык и интересы (через пробел)."""
+    c.execute("ALTER TABLE users ADD COLUMN language TEXT")
+    c.execute("ALTER TABLE users ADD COLUMN tags TEXT")
+
+
+def _v6_broadcasts(c):
+    """Рассылки администратора и их прогресс (последний обработанный user_id)."""
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            admin_id INTEGER,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            removed INTEGER NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        );
+    """)
+
+
+def _v7_message_archive(c):
+    """Каталог архивных разделов сообщений (по месяцам) и число архивированных сообщений по дням."""
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS message_archive (
+            month TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            messages INTEGER NOT NULL DEFAULT 0,
+            first_at DATETIME,
+            last_at DATETIME,
+            sealed INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS message_days (
+            day TEXT PRIMARY KEY,
+            messages INTEGER NOT NULL
+        );
+    """)
+
+
+MIGRATIONS = [_v1_base_tables, _v2_stats_tables, _v3_integer_keys, _v4_indexes, _v5_search_criteria,
+              _v6_broadcasts, _v7_message_archive]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Применяет недостающие миграции
+    :param conn: соединение sqlite3
+    :return: (версия до миграции, версия после)
+    """
+    old_version = get_version(conn)
+    if old_version > SCHEMA_VERSION:
+        raise RuntimeError(f"Версия схемы базы данных {old_version} новее, чем поддерживает бот "
+                           f"({SCHEMA_VERSION}).")
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= old_version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logging.info("Миграция базы данных до версии %s: %s", version, migration.__doc__.strip().splitlines()[0])
+    return old_version, get_version(conn)
+
+
+if __name__ == '__main__':
+    from config import DB_PATH
+    path = sys.argv[1] if len(sys.argv) > 1 else DB_PATH
+    connection = sqlite3.connect(path)
+    before, after = migrate(connection)
+    print(f"{path}: версия схемы {before} -> {after} (последняя: {SCHEMA_VERSION})")
+    connection.close()
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import math
+import time
+from UserStatus import UserStatus
+import db_connection
+import metrics
+
+
+class TimingWheel:
+    """
+    Иерархическое колесо таймеров. Каждый уровень - кольцо слотов; слот нижнего уровня длится
+    один тик, слот следующего - целый оборот предыдущего. Постановка и отмена таймера - O(1),
+    сдвиг на тик обрабатывает только один слот (и раз в оборот переносит слот верхнего уровня
+    на нижние). Сроки дальше полного оборота верхнего уровня обрезаются до него.
+    """
+
+    def __init__(self, slots=(60, 60, 24)):
+        self.slots = slots
+        self.spans = []  # длительность слота каждого уровня в тиках
+        span = 1
+        for count in slots:
+            self.spans.append(span)
+            span *= count
+        self.levels = [[set() for _ in range(count)] for count in slots]
+        self.now = 0  # номер текущего тика
+        self._timers = {}  # ключ -> (уровень, слот, тик срабатывания)
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def schedule(self, key, ticks):
+        """Ставит (или переносит) таймер ключа на ticks тиков вперед."""
+        self.cancel(key)
+        self._insert(key, self.now + max(1, ticks))
+
+    def cancel(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            self.levels[timer[0]][timer[1]].discard(key)
+
+    def _insert(self, key, due):
+        last = len(self.slots) - 1
+        due = min(due, self.now + self.spans[last] * self.slots[last] - 1)
+        remaining = due - self.now
+        for level, (span, count) in enumerate(zip(self.spans, self.slots)):
+            if remaining < span * count:
+                slot = (due // span) % count
+                self.levels[level][slot].add(key)
+                self._timers[key] = (level, slot, due)
+                return
+
+    def advance(self):
+        """Сдвигает колесо на один тик и возвращает ключи, чей срок наступил."""
+        self.now += 1
+        for level in range(1, len(self.slots)):
+            span = self.spans[level]
+            if self.now % span:
+                break
+            # Начался новый слот уровня: его таймеры переходят на нижние уровни
+            slot = (self.now // span) % self.slots[level]
+            keys, self.levels[level][slot] = self.levels[level][slot], set()
+            for key in keys:
+                self._insert(key, self._timers[key][2])
+        slot = self.now % self.slots[0]
+        expired, self.levels[0][slot] = self.levels[0][slot], set()
+        for key in expired:
+            del self._timers[key]
+        return expired
+
+
+class SessionReaper:
+    """
+    Завершает поиск и чаты пользователей, которые долго ничего не присылали
+    (таймауты по статусам - UserStatus.timeouts).
+    touch() только запоминает время последней активности. Таймер пользователя ставится на
+    минимальный таймаут; при срабатывании статус берется из кэша сессий, и если пользователь
+    был активен позже, таймер просто переносится на остаток. Поэтому сообщения не двигают таймеры,
+    а таблица users не сканируется.
+    """
+
+    def __init__(self, timeouts=UserStatus.timeouts, tick=1.0):
+        self.timeouts = timeouts
+        self.tick = tick
+        self.wheel = TimingWheel()
+        # Корутина on_expire(user_id, status, partner_id): завершить сессию и уведомить собеседника
+        self.on_expire = None
+        # Фильтр своих пользователей (в многопроцессном режиме у каждого шарда свои)
+        self.owns = lambda user_id: True
+        self._last_seen = {}
+        self._task = None
+
+    def touch(self, user_id):
+        """Отмечает активность пользователя."""
+        if not self.timeouts:
+            # Все таймауты отключены: следить не за чем
+            return
+        self._last_seen[user_id] = time.monotonic()
+        if user_id not in self.wheel:
+            self.wheel.schedule(user_id, self._ticks(min(self.timeouts.values())))
+
+    def is_active(self, user_id, status=UserStatus.COUPLED):
+        """False, если пользователь молчит дольше таймаута статуса (неизвестный считается активным)."""
+        last_seen = self._last_seen.get(user_id)
+        return last_seen is None or time.monotonic() - last_seen < self.timeouts.get(status, math.inf)
+
+    async def restore(self):
+        """После перезапуска начинает отсчет для всех пользователей в поиске и в чате."""
+        for status in self.timeouts:
+            for user_id in await db_connection.get_user_ids_by_status(status):
+                if self.owns(user_id):
+                    self.touch(user_id)
+
+    def _ticks(self, seconds):
+        return math.ceil(seconds / self.tick)
+
+    async def _expire(self, user_id):
+        session = await db_connection.get_session(user_id)
+        timeout = self.timeouts.get(session[0]) if session else None
+        if timeout is None:
+            # Сессия уже завершена: следить снова начнем при следующей активности
+            self._last_seen.pop(user_id, None)
+            return
+        idle = time.monotonic() - self._last_seen.get(user_id, 0)
+        if idle < timeout:
+            self.wheel.schedule(user_id, self._ticks(timeout - idle))
+            return
+        self._last_seen.pop(user_id, None)
+        metrics.registry.counter("bot_reaped_sessions_total", status=session[0]).inc()
+        logging.info("Сессия %s (%s) завершена после %.0f с без активности.", user_id, session[0], idle)
+        await self.on_expire(user_id, *session)
+
+    async def _run(self):
+        started = time.monotonic()
+        while True:
+            await asyncio.sleep(self.tick)
+            # Если цикл событий был занят, наверстать пропущенные тики
+            target = int((time.monotonic() - started) / self.tick)
+            while self.wheel.now < target:
+                for user_id in self.wheel.advance():
+                    try:
+                        await self._expire(user_id)
+                    except Exception as e:
+                        logging.error("Ошибка при завершении сессии %s: %s", user_id, e)
+
+    def start(self):
+        """Запускает фоновую задачу колеса таймеров."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {"tracked": len(self._last_seen), "timers": len(self.wheel)}
+
+
+reaper = SessionReaper()
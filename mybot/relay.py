@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import metrics
+from config import RELAY_ALBUM_WINDOW, RELAY_USER_RATE, RELAY_USER_BURST
+from sender import scheduler, TokenBucket, prune_full_buckets, is_unreachable
+
+# copyMessages принимает не больше 100 сообщений за раз
+MAX_BATCH = 100
+
+
+class _Outbox:
+    """Сообщения одного отправителя одному получателю, ожидающие пересылки."""
+    __slots__ = ("bot", "message_ids", "timer", "busy")
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.message_ids = []
+        self.timer = None  # ожидание остальных частей альбома
+        self.busy = False  # запрос к Bot API уже в очереди или выполняется
+
+
+class _Sender:
+    """Ограничение частоты сообщений одного отправителя."""
+    __slots__ = ("bucket", "media_group_id", "allowed", "warned")
+
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.media_group_id = None  # последний альбом: его части считаются одним сообщением
+        self.allowed = True  # решение для последнего сообщения (и остальных частей его альбома)
+        self.warned = False  # отправителю уже сообщили, что сообщения не доставляются
+
+
+class Relay:
+    """
+    Пересылка сообщений собеседнику пачками.
+    Части альбома (общий media_group_id) собираются album_window секунд и пересылаются одним
+    вызовом copyMessages, который сохраняет альбом и порядок частей. Пока запрос для пары
+    отправитель-получатель в пути, новые сообщения копятся и уходят следующим одним запросом:
+    серия быстрых сообщений стоит не больше двух запросов и не переставляется местами.
+    Один отправитель пересылает не больше user_rate сообщений в секунду (user_burst подряд),
+    лишние сообщения не пересылаются. Если получатель заблокировал бота, накопленные для него
+    сообщения отбрасываются, а новые не отправляются, пока он снова не напишет боту.
+    """
+
+    def __init__(self, album_window=RELAY_ALBUM_WINDOW, user_rate=RELAY_USER_RATE, user_burst=RELAY_USER_BURST):
+        self.album_window = album_window
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        # Корутина on_blocked(user_id): получатель заблокировал бота или удалил аккаунт
+        self.on_blocked = None
+        self._outboxes = {}  # (from_chat_id, chat_id) -> _Outbox
+        self._senders = {}  # from_chat_id -> _Sender
+        self._unreachable = set()  # чаты, отправка в которые завершилась ошибкой is_unreachable
+        self._tasks = set()
+        self._messages = metrics.registry.counter("bot_relay_messages_total")
+        self._requests = metrics.registry.counter("bot_relay_requests_total")
+
+    def relay(self, bot, message, chat_id):
+        """
+        Ставит сообщение в очередь пересылки; возвращается сразу, не дожидаясь отправки
+        :param bot: бот, через которого отправлять
+        :param message: сообщение отправителя
+        :param chat_id: чат собеседника
+        :return: False, если сообщение не будет переслано (превышен лимит отправителя или получатель недоступен)
+        """
+        if chat_id in self._unreachable:
+            metrics.registry.counter("bot_relay_dropped_total", reason="unreachable").inc()
+            return False
+        if not self._allow(bot, message):
+            metrics.registry.counter("bot_relay_dropped_total", reason="flood").inc()
+            return False
+        key = (message.chat_id, chat_id)
+        outbox = self._outboxes.get(key)
+        if outbox is None:
+            outbox = self._outboxes[key] = _Outbox(bot)
+        outbox.message_ids.append(message.message_id)
+        self._messages.inc()
+        if message.media_group_id is not None:
+            if outbox.timer is None:
+                outbox.timer = asyncio.get_running_loop().call_later(self.album_window, self._album_ready, key)
+            return True
+        if outbox.timer is None and not outbox.busy:
+            self._flush(key)
+        return True
+
+    def reachable(self, user_id):
+        """Пользователь прислал обновление - значит, бот снова может ему писать."""
+        self._unreachable.discard(user_id)
+
+    def _allow(self, bot, message):
+        """Списывает токен отправителя; части одного альбома - одно сообщение."""
+        sender = self._senders.get(message.chat_id)
+        if sender is None:
+            prune_full_buckets(self._senders, lambda state: state.bucket)
+            sender = self._senders[message.chat_id] = _Sender(self.user_rate, self.user_burst)
+        if message.media_group_id is None or message.media_group_id != sender.media_group_id:
+            sender.media_group_id = message.media_group_id
+            sender.allowed = sender.bucket.take() == 0
+        if sender.allowed:
+            sender.warned = False
+        elif not sender.warned:
+            # Предупредить один раз за серию отброшенных сообщений
+            sender.warned = True
+            self._spawn(self._warn_flood(bot, message.chat_id))
+        return sender.allowed
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _album_ready(self, key):
+        outbox = self._outboxes[key]
+        outbox.timer = None
+        if not outbox.busy:
+            self._flush(key)
+
+    def _flush(self, key):
+        outbox = self._outboxes[key]
+        message_ids = sorted(outbox.message_ids[:MAX_BATCH])
+        del outbox.message_ids[:MAX_BATCH]
+        outbox.busy = True
+        self._spawn(self._send(key, outbox, message_ids))
+
+    async def _send(self, key, outbox, message_ids):
+        from_chat_id, chat_id = key
+        self._requests.inc()
+        try:
+            if len(message_ids) == 1:
+                await scheduler.copy_message(outbox.bot, chat_id=chat_id, from_chat_id=from_chat_id,
+                                             message_id=message_ids[0], protect_content=False)
+            else:
+                await scheduler.copy_messages(outbox.bot, chat_id=chat_id, from_chat_id=from_chat_id,
+                                              message_ids=message_ids, protect_content=False)
+            logging.debug("Переслано %s сообщений от %s к %s", len(message_ids), from_chat_id, chat_id)
+        except Exception as e:
+            if is_unreachable(e):
+                await self._drop_recipient(chat_id, outbox, e)
+                return
+            logging.error("Ошибка при пересылке сообщения: %s", e)
+            try:
+                await scheduler.send_message(outbox.bot, from_chat_id, "🤖 Ошибка при отправке сообщения.")
+            except Exception as e:
+                logging.error("Ошибка при отправке уведомления %s: %s", from_chat_id, e)
+        finally:
+            outbox.busy = False
+            if outbox.message_ids:
+                if outbox.timer is None:
+                    self._flush(key)
+            elif outbox.timer is None:
+                del self._outboxes[key]
+
+    async def _warn_flood(self, bot, chat_id):
+        """Предупреждение об отброшенных сообщениях; ошибки отправки обрабатываются как в _send."""
+        try:
+            await scheduler.send_message(bot, chat_id,
+                                         "🤖 Вы отправляете сообщения слишком часто, часть из них "
+                                         "не доставлена собеседнику. Подождите немного.")
+        except Exception as e:
+            if is_unreachable(e):
+                await self._mark_unreachable(chat_id, e)
+            else:
+                logging.error("Ошибка при отправке предупреждения в чат %s: %s", chat_id, e)
+
+    async def _drop_recipient(self, chat_id, outbox, error):
+        """Получатель недоступен: отбросить его очередь и сразу отпустить собеседника."""
+        if outbox.timer is not None:
+            outbox.timer.cancel()
+            outbox.timer = None
+        dropped = len(outbox.message_ids)
+        outbox.message_ids.clear()
+        metrics.registry.counter("bot_relay_dropped_total", reason="unreachable").inc(dropped)
+        await self._mark_unreachable(chat_id, error)
+
+    async def _mark_unreachable(self, chat_id, error):
+        """Запоминает недоступный чат и сообщает о нем через on_blocked."""
+        logging.warning("Чат %s недоступен (%s), собеседник отключен.", chat_id, error)
+        if len(self._unreachable) >= 10_000:
+            # Забытый чат стоит одного лишнего запроса; пользователь к тому времени уже удален из базы
+            self._unreachable.clear()
+        self._unreachable.add(chat_id)
+        if self.on_blocked is not None:
+            try:
+                await self.on_blocked(chat_id)
+            except Exception as e:
+                logging.error("Ошибка при удалении пользователя %s: %s", chat_id, e)
+
+    async def stop(self):
+        """Отправляет все накопленные сообщения (вызывается до остановки планировщика отправки)."""
+        for key, outbox in list(self._outboxes.items()):
+            if outbox.timer is not None:
+                outbox.timer.cancel()
+                outbox.timer = None
+                if not outbox.busy:
+                    self._flush(key)
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+relay = Relay()
@@ -0,0 +1,195 @@
+"""
+Хранение сообщений: таблица messages содержит только последние RETENTION_DAYS дней.
+Более старые сообщения переносятся в архивные разделы по месяцам - отдельные файлы SQLite
+(RETENTION_ARCHIVE_DIR/messages-ГГГГ-ММ.db), которые можно присоединить к базе (ATTACH) и
+опрашивать как обычную таблицу. Месяц, из которого в рабочей таблице больше ничего не осталось,
+сжимается в messages-ГГГГ-ММ.db.gz. В основной базе остается сводка: каталог разделов
+(message_archive) и число архивированных сообщений по дням (message_days).
+Просмотр каталога и перевод существующей базы в режим auto_vacuum=INCREMENTAL:
+
+    python retention.py [путь_к_базе] [--vacuum]
+"""
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+from config import (RETENTION_DAYS, RETENTION_ARCHIVE_DIR, RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE,
+                    RETENTION_INTERVAL, RETENTION_VACUUM_PAGES)
+import db_connection
+import metrics
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _next_month(month):
+    """Начало следующего месяца в формате timestamp: "2026-09" -> "2026-10-01 00:00:00"."""
+    year, number = map(int, month.split("-"))
+    year, number = (year + 1, 1) if number == 12 else (year, number + 1)
+    return f"{year:04d}-{number:02d}-01 00:00:00"
+
+
+def _compress(path):
+    """Сжимает закрытый раздел в path.gz (через временный файл) и удаляет исходный файл."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as source, gzip.open(path + ".gz.tmp", "wb") as target:
+        shutil.copyfileobj(source, target)
+    os.replace(path + ".gz.tmp", path + ".gz")
+    os.remove(path)
+
+
+def _decompress(path):
+    """Распаковывает path.gz обратно в path (через временный файл) и удаляет архив."""
+    with gzip.open(path + ".gz", "rb") as source, open(path + ".tmp", "wb") as target:
+        shutil.copyfileobj(source, target)
+    os.replace(path + ".tmp", path)
+    os.remove(path + ".gz")
+
+
+class MessageArchiver:
+    """
+    Фоновый перенос старых сообщений в архив.
+    Сообщения переносятся с начала таблицы (по id, то есть от самых старых) пачками по batch_size:
+    копирование в раздел и удаление из таблицы - две короткие транзакции, между пачками пауза,
+    поэтому блокировка записи не удерживается надолго и журнал сообщений пишется между пачками.
+    Индекс по времени не нужен: самые старые строки всегда в начале таблицы.
+    Строки без даты в timestamp (NULL или испорченное значение) пропускаются и остаются в таблице.
+    """
+
+    def __init__(self, retention_days=RETENTION_DAYS, archive_dir=RETENTION_ARCHIVE_DIR,
+                 batch_size=RETENTION_BATCH_SIZE, pause=RETENTION_BATCH_PAUSE, interval=RETENTION_INTERVAL,
+                 vacuum_pages=RETENTION_VACUUM_PAGES):
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        # Вести архив (в многопроцессном режиме - только один шард)
+        self.enabled = True
+        self._task = None
+
+    def partition_path(self, month):
+        return os.path.join(self.archive_dir, f"messages-{month}.db")
+
+    async def run_once(self, now=None):
+        """
+        Переносит в архив все сообщения старше retention_days, сжимает закрытые месяцы
+        и возвращает освободившиеся страницы файловой системе
+        :return: число перенесенных сообщений
+        """
+        now = now or datetime.now(timezone.utc)
+        before = (now - timedelta(days=self.retention_days)).strftime(TIMESTAMP_FORMAT)
+        moved = 0
+        while True:
+            oldest = await db_connection.get_oldest_message_time()
+            if oldest is None or oldest >= before:
+                break
+            count = await self._archive_month(oldest[:7], before)
+            if not count:
+                break
+            moved += count
+        if moved:
+            logging.warning("В архив перенесено %s сообщений старше %s.", moved, before)
+        await self._seal(before)
+        await self._vacuum()
+        return moved
+
+    async def _archive_month(self, month, before):
+        path = self.partition_path(month)
+        alias = "archive_" + month.replace("-", "_")
+        os.makedirs(self.archive_dir, exist_ok=True)
+        await self._reopen(month, path)
+        await db_connection.attach_archive(path, alias)
+        moved = 0
+        try:
+            while True:
+                rows = await db_connection.copy_messages_to_archive(alias, month, before, self.batch_size)
+                if not rows:
+                    break
+                await db_connection.delete_archived_messages(month, path, rows)
+                moved += len(rows)
+                metrics.registry.counter("bot_archived_messages_total").inc(len(rows))
+                await asyncio.sleep(self.pause)
+        finally:
+            await db_connection.detach_archive(alias)
+        return moved
+
+    async def _reopen(self, month, path):
+        """
+        В рабочей таблице нашлись сообщения уже сжатого месяца (например, таблицу восстановили
+        из резервной копии): раздел распаковывается и снова открывается для записи, а не создается
+        пустой рядом со сжатым. Месяц будет сжат заново, когда в рабочей таблице его сообщений не останется.
+        """
+        if not os.path.exists(path + ".gz") or os.path.exists(path):
+            return
+        logging.warning("Архивный раздел %s уже сжат, но в таблице messages остались его сообщения: "
+                        "раздел открыт заново.", month)
+        await asyncio.get_running_loop().run_in_executor(None, _decompress, path)
+        await db_connection.seal_message_archive(month, path, sealed=False)
+
+    async def _seal(self, before):
+        """Сжимает разделы месяцев, которые закончились раньше before и уже целиком в архиве."""
+        oldest = await db_connection.get_oldest_message_time()
+        for month, path, *_, sealed in await db_connection.get_message_archive():
+            month_end = _next_month(month)
+            if sealed or month_end > before or (oldest is not None and oldest < month_end):
+                continue
+            await asyncio.get_running_loop().run_in_executor(None, _compress, path)
+            await db_connection.seal_message_archive(month, path + ".gz")
+            logging.warning("Архивный раздел %s сжат: %s.gz", month, path)
+
+    async def _vacuum(self):
+        """Возвращает свободные страницы по vacuum_pages за транзакцию (пока их становится меньше)."""
+        free = None
+        while True:
+            left = await db_connection.incremental_vacuum(self.vacuum_pages)
+            if not left or left == free:
+                return
+            free = left
+            await asyncio.sleep(self.pause)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.error("Ошибка при переносе сообщений в архив: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Запускает периодический перенос сообщений в архив."""
+        if self.enabled and self.retention_days and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+archiver = MessageArchiver()
+
+
+if __name__ == '__main__':
+    from config import DB_PATH
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    connection = sqlite3.connect(args[0] if args else DB_PATH)
+    if "--vacuum" in sys.argv:
+        # Однократно: включить auto_vacuum для существующей базы (VACUUM переписывает весь файл)
+        connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.execute("VACUUM")
+    hot = connection.execute("SELECT COUNT(*), MIN(timestamp) FROM messages").fetchone()
+    print(f"Рабочая таблица: {hot[0]} сообщений с {hot[1]}")
+    for month, path, messages, first_at, last_at, sealed in connection.execute(
+            "SELECT month, path, messages, first_at, last_at, sealed FROM message_archive ORDER BY month"):
+        print(f"{month}: {messages} сообщений ({first_at} - {last_at}), {path}{' (сжат)' if sealed else ''}")
+    connection.close()
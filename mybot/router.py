@@ -0,0 +1,141 @@
+"""
+Диспетчер обновлений по статусу пользователя.
+Заменяет ConversationHandler с цепочкой фильтров: сессия пользователя (статус и собеседник)
+берется один раз (обычно из кэша сессий), команда разбирается один раз, а обработчик выбирается
+по заранее построенным таблицам "статус -> команда -> обработчик" и "статус -> обработчик сообщений".
+UserUpdateProcessor сохраняет порядок обновлений каждого пользователя при параллельной обработке.
+"""
+import logging
+from collections import deque
+from telegram import MessageEntity, Update
+from telegram.ext import BaseUpdateProcessor
+import db_connection
+import metrics
+
+
+def parse_command(message, bot_username):
+    """
+    Разбирает команду в начале сообщения ("/chat ru музыка", "/help@my_bot")
+    :param message: сообщение
+    :param bot_username: имя бота (команды для других ботов в группах игнорируются)
+    :return: (команда в нижнем регистре, аргументы) или (None, None), если сообщение не команда
+    """
+    entities = message.entities
+    if not entities or entities[0].type != MessageEntity.BOT_COMMAND or entities[0].offset != 0:
+        return None, None
+    text = message.text
+    command, _, username = text[1:entities[0].length].partition("@")
+    if username and username.lower() != bot_username.lower():
+        return None, None
+    return command.lower(), text.split()[1:]
+
+
+class Router:
+    """
+    Таблицы обработчиков по статусу пользователя; статус None - пользователя нет в базе данных
+    (он еще не нажимал /start).
+    Обработчик команды - корутина (update, context), аргументы команды передаются в context.args.
+    Обработчик сообщения (не команды) и неизвестной команды - корутина (update, context, session),
+    где session - (статус, ID собеседника) или None.
+    Состояние между обновлениями нигде, кроме статуса в базе данных, не хранится, поэтому после
+    перезапуска бота ничего восстанавливать не нужно.
+    """
+
+    def __init__(self):
+        self._commands = {}  # статус -> {команда: обработчик}
+        self._messages = {}  # статус -> обработчик сообщений
+        self._unknown = {}  # статус -> обработчик неизвестных команд
+        # Корутина (update, context): изменение статуса бота в чате пользователя (например, блокировка)
+        self.on_chat_member = None
+
+    def command(self, name, callback, statuses):
+        """Регистрирует команду /name для пользователей с перечисленными статусами."""
+        callback = metrics.timed(callback)
+        for status in statuses:
+            self._commands.setdefault(status, {})[name.lower()] = callback
+
+    def message(self, callback, statuses):
+        """Регистрирует обработчик сообщений, не являющихся командами."""
+        callback = metrics.timed(callback)
+        for status in statuses:
+            self._messages[status] = callback
+
+    def unknown_command(self, callback, statuses):
+        """Регистрирует обработчик команд, которых нет в таблице статуса."""
+        callback = metrics.timed(callback)
+        for status in statuses:
+            self._unknown[status] = callback
+
+    async def dispatch(self, update, context):
+        """Обработчик всех обновлений (TypeHandler в группе 0)."""
+        user = update.effective_user
+        if user is None:
+            return
+        if update.my_chat_member is not None:
+            if self.on_chat_member is not None and await db_connection.get_session(user.id) is not None:
+                await self.on_chat_member(update, context)
+            return
+        # Правки сообщений, посты каналов и т.п. не обрабатываются
+        message = update.message
+        if message is None:
+            return
+
+        session = await db_connection.get_session(user.id)
+        status = session[0] if session is not None else None
+        if message.text is not None:
+            command, args = parse_command(message, context.bot.username)
+            if command is not None:
+                callback = self._commands.get(status, {}).get(command)
+                if callback is not None:
+                    context.args = args
+                    await callback(update, context)
+                    return
+                callback = self._unknown.get(status)
+                if callback is not None:
+                    await callback(update, context, session)
+                return
+        callback = self._messages.get(status)
+        if callback is not None:
+            await callback(update, context, session)
+
+
+class UserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обновления разных пользователей обрабатываются параллельно (не больше max_concurrent_updates),
+    а обновления одного пользователя - строго по очереди поступления: иначе при холодном кэше
+    сессий чтения из базы завершаются в любом порядке, сообщения приходят собеседнику
+    переставленными, а /chat и /exit одного пользователя перемешиваются.
+    Пока обновление пользователя обрабатывается, следующие встают в его очередь и выполняются
+    той же задачей, поэтому один пользователь занимает не больше одного слота.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._queues = {}  # ID пользователя -> корутины его обновлений, ожидающие обработки
+
+    async def do_process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await coroutine
+            return
+        queue = self._queues.get(user.id)
+        if queue is not None:
+            queue.append(coroutine)
+            return
+        queue = self._queues[user.id] = deque([coroutine])
+        try:
+            while queue:
+                try:
+                    await queue.popleft()
+                except Exception as e:
+                    logging.error("Ошибка при обработке обновления пользователя %s: %s", user.id, e)
+        finally:
+            del self._queues[user.id]
+            for pending in queue:
+                pending.close()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,262 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from telegram.error import RetryAfter, Forbidden, BadRequest
+import metrics
+from config import (SEND_GLOBAL_RATE, SEND_GLOBAL_BURST, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_MAX_IN_FLIGHT,
+                    SEND_MAX_RETRIES)
+
+
+class Priority:
+    RELAY = 0  # сообщения собеседников и ответы ИИ
+    NOTICE = 1  # системные уведомления бота
+    BULK = 2  # массовые рассылки
+
+    lanes = [RELAY, NOTICE, BULK]
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше burst за раз."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now=None):
+        """
+        Забирает токен, если он есть
+        :return: 0, если токен получен, иначе сколько секунд ждать до появления токена
+        """
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+def prune_full_buckets(buckets, bucket_of=lambda value: value, limit=10_000):
+    """
+    Ограничивает словарь "ключ -> ведро (или объект с ведром)": когда в нем limit записей,
+    удаляет записи, чье ведро полностью восстановилось - они не отличаются от новых.
+    Вызывается перед добавлением записи
+    """
+    if len(buckets) < limit:
+        return
+    now = time.monotonic()
+    for key in [key for key, value in buckets.items() if bucket_of(value).is_full(now)]:
+        del buckets[key]
+
+
+def is_unreachable(error):
+    """
+    Ошибка отправки означает, что чат больше недоступен: пользователь заблокировал бота,
+    удалил аккаунт или чат не найден. Повторные отправки в такой чат только тратят лимит.
+    """
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and "chat not found" in error.message.lower()
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat_id", "call", "future", "method", "attempts")
+
+    def __init__(self, priority, seq, chat_id, call, future, method):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.method = method
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SendScheduler:
+    """
+    Центральный планировщик исходящих запросов к Bot API.
+    Учитывает общий лимит Telegram (~30 сообщений в секунду) и лимит на один чат, отдает
+    пересылку сообщений собеседников вперед системных уведомлений и рассылок, а при ответе
+    429 (RetryAfter) приостанавливает отправку на указанное Telegram время и повторяет запрос.
+    """
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, global_burst=SEND_GLOBAL_BURST,
+                 chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST,
+                 max_in_flight=SEND_MAX_IN_FLIGHT, max_retries=SEND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats = {}
+        self._ready = []  # куча задач, готовых к отправке (приоритет, порядок поступления)
+        self._deferred = {}  # задачи, отложенные из-за лимита чата -> таймер возврата в очередь
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._paused_until = 0.0
+        self._task = None
+        self._sending = set()  # задачи запросов, выполняющихся прямо сейчас
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def set_limits(self, global_rate, global_burst, chat_rate, chat_burst):
+        """Меняет лимиты отправки (например, чтобы нагрузочный тест не упирался в лимиты Telegram)."""
+        self._global = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._chats.clear()
+
+    def start(self):
+        """Запускает диспетчер отправки."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает диспетчер и дожидается запросов в пути; неотправленные запросы завершаются с ошибкой."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Запрос, получивший 429 в это время, возвращается в очередь и отменяется ниже
+        while self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+        for job, timer in self._deferred.items():
+            timer.cancel()
+            if not job.future.done():
+                job.future.cancel()
+        self._deferred.clear()
+        for job in self._ready:
+            if not job.future.done():
+                job.future.cancel()
+        self._ready.clear()
+
+    def submit(self, chat_id, call, priority=Priority.NOTICE, method="request"):
+        """
+        Ставит запрос в очередь
+        :param chat_id: чат-получатель (для лимита на чат)
+        :param call: функция без аргументов, возвращающая корутину запроса к Bot API
+        :param priority: полоса приоритета из Priority
+        :param method: имя метода Bot API (для метрик)
+        :return: future с результатом запроса
+        """
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._ready, _Job(priority, next(self._seq), chat_id, call, future, method))
+        self._wakeup.set()
+        return future
+
+    async def send_message(self, bot, chat_id, text, priority=Priority.NOTICE, **kwargs):
+        return await self.submit(chat_id, lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs), priority,
+                                 "sendMessage")
+
+    async def copy_message(self, bot, chat_id, from_chat_id, message_id, priority=Priority.RELAY, **kwargs):
+        return await self.submit(chat_id, lambda: bot.copy_message(chat_id=chat_id, from_chat_id=from_chat_id,
+                                                                   message_id=message_id, **kwargs), priority,
+                                 "copyMessage")
+
+    async def copy_messages(self, bot, chat_id, from_chat_id, message_ids, priority=Priority.RELAY, **kwargs):
+        return await self.submit(chat_id, lambda: bot.copy_messages(chat_id=chat_id, from_chat_id=from_chat_id,
+                                                                    message_ids=message_ids, **kwargs), priority,
+                                 "copyMessages")
+
+    def stats(self):
+        """Возвращает глубину очереди по полосам и счетчики отправки."""
+        depth = {lane: 0 for lane in Priority.lanes}
+        for job in self._ready:
+            depth[job.priority] += 1
+        return {"queue_depth": depth, "deferred": len(self._deferred), "sent": self.sent,
+                "failed": self.failed, "retried": self.retried, "chats_tracked": len(self._chats)}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            prune_full_buckets(self._chats)
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _defer(self, job, delay):
+        """Возвращает задачу в очередь через delay секунд, не задерживая остальные чаты."""
+        def requeue():
+            del self._deferred[job]
+            heapq.heappush(self._ready, job)
+            self._wakeup.set()
+        self._deferred[job] = asyncio.get_running_loop().call_later(delay, requeue)
+
+    async def _run(self):
+        while True:
+            if not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            job = heapq.heappop(self._ready)
+            if job.future.done():
+                continue
+            wait = self._chat_bucket(job.chat_id).take()
+            if wait:
+                self._defer(job, wait)
+                continue
+            wait = self._global.take()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self._global.take()
+            await self._in_flight.acquire()
+            task = asyncio.create_task(self._execute(job))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _execute(self, job):
+        metrics.registry.counter("bot_api_calls_total", method=job.method).inc()
+        started = time.perf_counter()
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            metrics.registry.counter("bot_api_errors_total", method=job.method, error="RetryAfter").inc()
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            logging.warning("Telegram просит подождать %s с (чат %s).", retry_after, job.chat_id)
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            job.attempts += 1
+            if job.attempts <= self.max_retries:
+                self.retried += 1
+                heapq.heappush(self._ready, job)
+                self._wakeup.set()
+            else:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+        except Exception as e:
+            metrics.registry.counter("bot_api_errors_total", method=job.method, error=type(e).__name__).inc()
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            metrics.registry.histogram("bot_api_request_seconds", method=job.method).observe(
+                time.perf_counter() - started)
+            self._in_flight.release()
+
+
+scheduler = SendScheduler()
@@ -0,0 +1,58 @@
+from collections import OrderedDict
+
+
+class SessionCache:
+    """
+    Ограниченный LRU-кэш сессий: user_id -> (status, partner_id).
+    Заполняется при записи в базу данных (write-through) и при промахах чтения.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id):
+        """Возвращает (status, partner_id) или None при промахе."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry
+
+    def put(self, user_id, status, partner_id):
+        """Записывает актуальное состояние сессии (вызывается после фиксации транзакции)."""
+        self._entries[user_id] = (status, partner_id)
+        self._entries.move_to_end(user_id)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def add(self, user_id, status, partner_id):
+        """
+        Добавляет значение, прочитанное из базы данных, если запись еще не появилась.
+        Так результат чтения, начатого до записи, не затирает более свежее значение.
+        """
+        if user_id not in self._entries:
+            self.put(user_id, status, partner_id)
+
+    def discard(self, user_id):
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """Возвращает счетчики попаданий и промахов."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,415 @@
+"""
+Многопроцессный режим: входной процесс получает обновления и раскладывает их по N процессам-
+обработчикам (шардам) по user_id, поэтому разбор обновлений, фильтры и обработчики работают на
+N ядрах. Все обновления одного пользователя попадают в один и тот же шард, так что его запись
+в кэше сессий живет только там.
+
+Общее состояние - база данных SQLite (WAL, у каждого процесса свои соединения). Очередь поиска
+одна на всех и находится во входном процессе (локальный координатор): шарды вызывают
+find_partner/cancel через очередь multiprocessing, а координатор соединяет пару одной
+транзакцией. Пересылка в другой шард не нужна - сообщение партнеру отправляется через Bot API
+из любого процесса. Если запись меняет сессию пользователя из другого шарда (пару соединил
+координатор, собеседник вышел или заблокировал бота), его шард получает сообщение "invalidate"
+и сбрасывает запись в кэше.
+
+Запуск: SHARDS = N в config.py и python bot.py (или python shards.py [N]).
+"""
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import sys
+import threading
+import warnings
+from telegram import Bot, Update
+from telegram.error import TelegramError
+from config import (BOT_TOKEN, BOT_API_URL, SHARDS, SESSION_CACHE_SIZE, SEND_GLOBAL_RATE, SEND_GLOBAL_BURST,
+                    SEND_CHAT_RATE, SEND_CHAT_BURST, WEBHOOK_ENABLED, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+                    WEBHOOK_SECRET, WEBHOOK_URL, METRICS_HOST, METRICS_PORT)
+from session_cache import SessionCache
+from matchmaking import matchmaker
+from sender import scheduler
+from reaper import reaper
+from broadcast import broadcaster
+from retention import archiver
+import bot
+import db_connection
+import httpserver
+import metrics
+
+# Входному процессу нужен сырой JSON обновлений (разбор в объекты Update - работа шардов), поэтому
+# getUpdates вызывается через do_api_request, о чем PTB предупреждает
+warnings.filterwarnings("ignore", message=r"Please use 'Bot\.getUpdates'")
+
+
+def shard_of(user_id, shards):
+    """Номер шарда, которому принадлежит пользователь."""
+    return user_id % shards
+
+
+def update_user_id(update):
+    """
+    Достает ID пользователя из сырого обновления без создания объекта Update
+    :param update: обновление (dict)
+    :return: ID отправителя или 0, если его нет (такие обновления обрабатывает шард 0)
+    """
+    for value in update.values():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("chat") or value.get("user")
+            if sender:
+                return sender["id"]
+    return 0
+
+
+class ShardLink:
+    """
+    Связь шарда с координатором и другими шардами. Входящие сообщения (обновления, ответы
+    координатора, инвалидации кэша) читаются отдельным потоком и передаются в цикл событий.
+    """
+
+    def __init__(self, index, shards, inboxes, requests):
+        self.index = index
+        self.shards = shards
+        self.inboxes = inboxes
+        self.requests = requests
+        self.application = None
+        self.stopped = None
+        self._loop = None
+        self._calls = itertools.count()
+        self._pending = {}
+        self._tasks = set()
+
+    def owns(self, user_id):
+        return shard_of(user_id, self.shards) == self.index
+
+    def start(self, application):
+        self.application = application
+        self.stopped = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        threading.Thread(target=self._read_inbox, name=f"shard-{self.index}-inbox", daemon=True).start()
+
+    def _read_inbox(self):
+        inbox = self.inboxes[self.index]
+        while True:
+            kind, payload = inbox.get()
+            self._loop.call_soon_threadsafe(self._dispatch, kind, payload)
+            if kind == "stop":
+                return
+
+    def _dispatch(self, kind, payload):
+        if kind == "updates":
+            for data in payload:
+                self.application.update_queue.put_nowait(Update.de_json(data, self.application.bot))
+        elif kind == "invalidate":
+            db_connection.session_cache.invalidate(payload)
+        elif kind == "reply":
+            call_id, error, result = payload
+            future = self._pending.pop(call_id, None)
+            if future is None or future.done():
+                return
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(result)
+        elif kind == "paired":
+            task = asyncio.create_task(bot.notify_paired(self.application.bot, payload))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif kind == "stop":
+            self.stopped.set()
+
+    async def call(self, method, *args):
+        """Вызывает метод координатора и ждет ответа."""
+        call_id = next(self._calls)
+        future = self._pending[call_id] = self._loop.create_future()
+        self.requests.put((method, self.index, call_id, args))
+        return await future
+
+    def send(self, method, *args):
+        """Вызывает метод координатора без ожидания ответа."""
+        self.requests.put((method, self.index, None, args))
+
+    def invalidate(self, user_id):
+        """Просит шард-владелец сбросить сессию пользователя в кэше."""
+        self.inboxes[shard_of(user_id, self.shards)].put(("invalidate", user_id))
+
+
+class ShardSessionCache(SessionCache):
+    """
+    Кэш сессий шарда: хранит только пользователей этого шарда. Изменение чужой сессии
+    (например, партнера при выходе из чата) не кэшируется, а отправляется шарду-владельцу.
+    """
+
+    def __init__(self, maxsize, link):
+        super().__init__(maxsize)
+        self.link = link
+        self._invalidations = 0
+        self._reads = {}  # user_id -> номер инвалидации на момент промаха
+
+    def get(self, user_id):
+        entry = super().get(user_id)
+        if entry is None:
+            if len(self._reads) > self.maxsize:
+                self._reads.clear()
+            self._reads[user_id] = self._invalidations
+        return entry
+
+    def put(self, user_id, status, partner_id):
+        if self.link.owns(user_id):
+            super().put(user_id, status, partner_id)
+        else:
+            self.link.invalidate(user_id)
+
+    def add(self, user_id, status, partner_id):
+        # Если пока шло чтение, пришла инвалидация из другого процесса, прочитанное значение
+        # могло устареть: не кэшировать его, следующее обращение прочитает базу данных заново
+        if self._reads.pop(user_id, None) == self._invalidations and self.link.owns(user_id):
+            super().add(user_id, status, partner_id)
+
+    def discard(self, user_id):
+        if self.link.owns(user_id):
+            super().discard(user_id)
+        else:
+            self.link.invalidate(user_id)
+
+    def invalidate(self, user_id):
+        """Сбрасывает сессию, измененную другим процессом."""
+        self._invalidations += 1
+        super().discard(user_id)
+
+
+class ShardMatchmaker:
+    """Подбор собеседника через координатор во входном процессе (интерфейс как у Matchmaker)."""
+
+    def __init__(self, link):
+        self.link = link
+
+    async def restore(self):
+        # Очередь поиска восстанавливает координатор
+        pass
+
+    async def find_partner(self, user_id, language=None, tags=()):
+        return await self.link.call("find_partner", user_id, language, tags)
+
+    def cancel(self, user_id):
+        self.link.send("cancel", user_id)
+
+
+async def _run_worker(link, token, base_url):
+    # Шард подменяет общие объекты бота на версии, работающие через координатор
+    db_connection.session_cache = ShardSessionCache(SESSION_CACHE_SIZE, link)
+    bot.matchmaker = ShardMatchmaker(link)
+    reaper.owns = link.owns
+    broadcaster.resume_on_start = link.index == 0
+    archiver.enabled = link.index == 0
+    bot.METRICS_PORT = METRICS_PORT + 1 + link.index if METRICS_PORT is not None else None
+
+    application = bot.build_application(token, base_url, updater=False)
+    await application.initialize()
+    await application.post_init(application)
+    # Общий лимит Telegram делится между шардами; лимит на чат остается прежним - сообщения
+    # в один чат почти всегда отправляет шард его собеседника
+    scheduler.set_limits(global_rate=SEND_GLOBAL_RATE / link.shards,
+                         global_burst=max(1, SEND_GLOBAL_BURST // link.shards),
+                         chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST)
+    await application.start()
+    link.start(application)
+    logging.info("Шард %s из %s запущен.", link.index, link.shards)
+    try:
+        await link.stopped.wait()
+    finally:
+        await application.stop()
+        # Как run_polling: досылка сообщений до закрытия клиента Bot API
+        await application.post_stop(application)
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+
+def run_worker(index, shards, inboxes, requests, token, base_url):
+    """Точка входа процесса-шарда."""
+    # Ctrl+C получает вся группа процессов; шард останавливается по команде входного процесса,
+    # чтобы успеть записать журнал сообщений и закрыть базу данных
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(ShardLink(index, shards, inboxes, requests), token, base_url))
+
+
+class Front:
+    """
+    Входной процесс: получает обновления (long polling или webhook), раскладывает их по шардам
+    и обслуживает очередь поиска собеседников.
+    """
+
+    def __init__(self, shards=SHARDS, token=BOT_TOKEN, base_url=BOT_API_URL):
+        self.shards = shards
+        self.bot = Bot(token, base_url=base_url) if base_url else Bot(token)
+        context = multiprocessing.get_context("spawn")
+        self.inboxes = [context.Queue() for _ in range(shards)]
+        self.requests = context.Queue()
+        self.processes = [context.Process(target=run_worker,
+                                          args=(index, shards, self.inboxes, self.requests, token, base_url),
+                                          name=f"shard-{index}", daemon=True)
+                          for index in range(shards)]
+        self._routed = [metrics.registry.counter("bot_shard_updates_total", shard=index) for index in range(shards)]
+        self._tasks = set()
+
+    def route(self, updates):
+        """Отправляет пачку обновлений шардам (одно сообщение в очередь на шард)."""
+        batches = [[] for _ in range(self.shards)]
+        for update in updates:
+            batches[shard_of(update_user_id(update), self.shards)].append(update)
+        for index, batch in enumerate(batches):
+            if batch:
+                self._routed[index].inc(len(batch))
+                self.inboxes[index].put(("updates", batch))
+
+    def _read_requests(self, loop):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            loop.call_soon_threadsafe(self._start_request, request)
+
+    def _start_request(self, request):
+        task = asyncio.create_task(self._handle_request(*request))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle_request(self, method, shard, call_id, args):
+        error = result = None
+        try:
+            if method == "find_partner":
+                user_id, language, tags = args
+                result = await matchmaker.find_partner(user_id, language, tags)
+                if result is not None:
+                    # Инвалидация уходит в очередь шарда раньше ответа, поэтому, получив ответ,
+                    # шард уже не прочитает из кэша старый статус IN_SEARCH
+                    for paired_id in (user_id, result):
+                        self.inboxes[shard_of(paired_id, self.shards)].put(("invalidate", paired_id))
+            elif method == "cancel":
+                user_id, = args
+                matchmaker.cancel(user_id)
+            else:
+                raise ValueError(f"Неизвестный метод координатора: {method}")
+        except Exception as e:
+            logging.error("Ошибка координатора (%s%s): %s", method, args, e)
+            error = str(e)
+        if call_id is not None:
+            self.inboxes[shard].put(("reply", (call_id, error, result)))
+
+    async def _on_match(self, user_id, partner_id):
+        """Пара найдена при расширении поиска: шарды обоих пользователей обновляют кэш и уведомляют их."""
+        for paired_id in (user_id, partner_id):
+            inbox = self.inboxes[shard_of(paired_id, self.shards)]
+            inbox.put(("invalidate", paired_id))
+            inbox.put(("paired", paired_id))
+
+    async def poll(self):
+        """Long polling: getUpdates и раскладка по шардам."""
+        await self.bot.delete_webhook()
+        offset = 0
+        while True:
+            try:
+                updates = await self.bot.do_api_request("getUpdates", api_kwargs={"offset": offset, "timeout": 30},
+                                                        read_timeout=40)
+            except TelegramError as e:
+                logging.warning("Ошибка getUpdates: %s", e)
+                await asyncio.sleep(1)
+                continue
+            if updates:
+                offset = updates[-1]["update_id"] + 1
+                self.route(updates)
+
+    async def serve_webhook(self):
+        """Webhook: принимает обновления на встроенном HTTP сервере и раскладывает по шардам."""
+        path = "/" + WEBHOOK_PATH.lstrip("/")
+
+        def authorize(method, request_path, headers):
+            # До чтения тела: чужие запросы отклоняются, не занимая память
+            if method != "POST" or request_path != path:
+                return 404
+            if headers.get("x-telegram-bot-api-secret-token") != WEBHOOK_SECRET:
+                return 403
+            return None
+
+        async def handle(request):
+            try:
+                update = json.loads(request.body)
+            except ValueError:
+                return 400, "text/plain", b"bad request"
+            self.route([update])
+            return 200, "text/plain", b""
+
+        server, port = await httpserver.serve(handle, WEBHOOK_LISTEN, WEBHOOK_PORT, authorize=authorize)
+        await self.bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+        logging.info("Webhook принимается на %s:%s%s", WEBHOOK_LISTEN, port, path)
+        async with server:
+            await server.serve_forever()
+
+    async def _watch_workers(self):
+        """Завершается с ошибкой, если какой-либо шард остановился (его пользователи остались бы без ответа)."""
+        sentinels = [process.sentinel for process in self.processes]
+        await asyncio.get_running_loop().run_in_executor(None, multiprocessing.connection.wait, sentinels)
+        stopped = [process.name for process in self.processes if not process.is_alive()]
+        raise RuntimeError(f"Шард остановился: {', '.join(stopped)}")
+
+    async def run(self, receive=None):
+        """
+        Запускает координатор и шарды и получает обновления
+        :param receive: корутина получения обновлений (по умолчанию poll или serve_webhook по config.py)
+        """
+        await db_connection.init()
+        # Схема обновляется до запуска шардов, чтобы миграции не выполнялись параллельно
+        await db_connection.create_db()
+        # Статусы меняют шарды, поэтому координатор всегда читает их из базы данных
+        db_connection.session_cache = SessionCache(0)
+        await matchmaker.restore()
+        matchmaker.on_match = self._on_match
+
+        for process in self.processes:
+            process.start()
+        loop = asyncio.get_running_loop()
+        threading.Thread(target=self._read_requests, args=(loop,), name="coordinator", daemon=True).start()
+        metrics_server = None
+        if METRICS_PORT is not None:
+            metrics.registry.describe("bot_shard_updates_total", "Обновления, переданные каждому шарду")
+            metrics.registry.gauge("bot_search_queue", lambda: {(): len(matchmaker)},
+                                   "Пользователи в очереди поиска")
+            metrics_server = await metrics.start_server(METRICS_PORT, METRICS_HOST)
+
+        await self.bot.initialize()
+        if receive is None:
+            receive = self.serve_webhook() if WEBHOOK_ENABLED else self.poll()
+        tasks = [asyncio.create_task(receive), asyncio.create_task(self._watch_workers())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            for inbox in self.inboxes:
+                inbox.put(("stop", None))
+            for process in self.processes:
+                await loop.run_in_executor(None, process.join, 10)
+            self.requests.put(None)
+            if metrics_server is not None:
+                metrics_server.close()
+            await self.bot.shutdown()
+            await db_connection.close()
+
+
+def main(shards=SHARDS):
+    if WEBHOOK_ENABLED:
+        bot.check_webhook_settings()
+    try:
+        asyncio.run(Front(shards).run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else SHARDS)
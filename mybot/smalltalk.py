@@ -0,0 +1,246 @@
+"""
+Локальные ответы в чате с ИИ: частые фразы ("привет", "как дела") обрабатываются в процессе,
+без запроса к Dialogflow.
+Сначала ищется интент из выгруженного набора (SMALLTALK_INTENTS), затем готовый ответ
+Dialogflow на тот же текст в кэше; Dialogflow вызывается только при промахе.
+"""
+import glob
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+from config import SMALLTALK_INTENTS, SMALLTALK_MIN_SCORE, SMALLTALK_CACHE_SIZE, SMALLTALK_CACHE_TTL
+import metrics
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_REPEATS = re.compile(r"([^\W\d_])\1{2,}")
+
+
+def normalize(text):
+    """
+    Приводит текст к виду, по которому ищутся интенты:
+    нижний регистр, ё -> е, без знаков препинания и эмодзи, "приветтт" -> "привет", одиночные пробелы.
+    """
+    text = _PUNCTUATION.sub(" ", text.lower().replace("ё", "е"))
+    return " ".join(_REPEATS.sub(r"\1", text).split())
+
+
+def cache_key(text):
+    """
+    Ключ кэша ответов Dialogflow: только нижний регистр, ё -> е и одиночные пробелы.
+    Числа, знаки и повторы сохраняются - "10 + 10" и "10 - 10" получают разные ответы.
+    """
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+class IntentMatcher:
+    """
+    Поиск интента по фразе.
+    Точное совпадение нормализованной фразы - поиск в словаре. Иначе кандидаты берутся из
+    обратного индекса "слово -> фразы", и фраза оценивается мерой Жаккара по множествам слов;
+    перебираются только фразы с общими словами, поэтому поиск занимает микросекунды.
+    """
+
+    def __init__(self):
+        self.intents = []  # (имя, ответы)
+        self._exact = {}  # нормализованная фраза -> номер интента
+        self._phrases = []  # (слова фразы, номер интента)
+        self._index = {}  # слово -> номера фраз
+        self._max_words = 0
+
+    def __len__(self):
+        return len(self.intents)
+
+    def add(self, name, phrases, responses):
+        """Добавляет интент с обучающими фразами и вариантами ответа."""
+        if not responses:
+            return
+        intent = len(self.intents)
+        self.intents.append((name, list(responses)))
+        for phrase in phrases:
+            phrase = normalize(phrase)
+            if not phrase or phrase in self._exact:
+                continue
+            self._exact[phrase] = intent
+            words = frozenset(phrase.split())
+            for word in words:
+                self._index.setdefault(word, []).append(len(self._phrases))
+            self._phrases.append((words, intent))
+            self._max_words = max(self._max_words, len(words))
+
+    def match(self, text, min_score=SMALLTALK_MIN_SCORE):
+        """
+        Ищет интент для нормализованного текста
+        :param text: текст после normalize()
+        :param min_score: минимальная оценка совпадения
+        :return: (имя, ответы, оценка от 0 до 1) или None
+        """
+        intent = self._exact.get(text)
+        if intent is not None:
+            return (*self.intents[intent], 1.0)
+        words = set(text.split())
+        # Оценка не больше |фраза| / |текст|: длинные сообщения не совпадут ни с одной фразой
+        if not words or self._max_words < len(words) * min_score:
+            return None
+        common = {}
+        for word in words:
+            for phrase in self._index.get(word, ()):
+                common[phrase] = common.get(phrase, 0) + 1
+        best, best_score = None, 0.0
+        for phrase, count in common.items():
+            phrase_words, intent = self._phrases[phrase]
+            score = count / (len(words) + len(phrase_words) - count)
+            if score > best_score:
+                best, best_score = intent, score
+        if best is None or best_score < min_score:
+            return None
+        return (*self.intents[best], best_score)
+
+    def load(self, path):
+        """
+        Загружает интенты из файла JSON ({"intents": [{"name", "phrases", "responses"}]})
+        или из распакованной выгрузки агента Dialogflow (папка с intents/*.json).
+        """
+        if os.path.isdir(path):
+            self._load_agent_export(path)
+            return
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for intent in data["intents"]:
+            self.add(intent["name"], intent["phrases"], intent["responses"])
+
+    def _load_agent_export(self, path, language="ru"):
+        for intent_file in glob.glob(os.path.join(path, "intents", "*.json")):
+            if "_usersays_" in intent_file:
+                continue
+            with open(intent_file, encoding="utf-8") as f:
+                intent = json.load(f)
+            responses = []
+            for response in intent.get("responses", ()):
+                for message in response.get("messages", ()):
+                    # Тип 0 - текстовый ответ; speech - строка или список вариантов
+                    if str(message.get("type")) != "0" or message.get("lang", language) != language:
+                        continue
+                    speech = message.get("speech", ())
+                    responses.extend([speech] if isinstance(speech, str) else speech)
+            usersays_file = f"{intent_file[:-len('.json')]}_usersays_{language}.json"
+            if not responses or not os.path.exists(usersays_file):
+                continue
+            with open(usersays_file, encoding="utf-8") as f:
+                phrases = ["".join(part["text"] for part in example["data"]) for example in json.load(f)]
+            self.add(intent["name"], phrases, responses)
+
+
+class ResponseCache:
+    """Ответы Dialogflow по тексту запроса (cache_key): LRU с ограниченным временем жизни записи."""
+
+    def __init__(self, maxsize=SMALLTALK_CACHE_SIZE, ttl=SMALLTALK_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # текст -> (срок годности, ответ)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, text):
+        entry = self._entries.get(text)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[text]
+            return None
+        self._entries.move_to_end(text)
+        return entry[1]
+
+    def put(self, text, response):
+        self._entries[text] = (time.monotonic() + self.ttl, response)
+        self._entries.move_to_end(text)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class SmallTalk:
+    """
+    Ответ на сообщение в чате с ИИ: локальный интент, ответ из кэша или запрос к Dialogflow.
+    Кэш общий для всех пользователей, поэтому в него попадают только ответы без контекстов
+    и параметров (Reply.cacheable); время жизни записи ограничивает устаревание ответов.
+    Экономия считается как среднее время ответа Dialogflow за вычетом времени локального ответа.
+    """
+
+    # Вес нового замера в скользящем среднем времени ответа Dialogflow
+    SMOOTHING = 0.1
+
+    def __init__(self, intents_path=SMALLTALK_INTENTS, min_score=SMALLTALK_MIN_SCORE):
+        self.intents_path = intents_path
+        self.min_score = min_score
+        self.matcher = IntentMatcher()
+        self.cache = ResponseCache()
+        # Корутина backend(user_id, text): ответ Dialogflow или None, если запрос не удался
+        self.backend = None
+        self.answers = {"intent": 0, "cache": 0, "dialogflow": 0}
+        self.saved_seconds = 0.0
+        self._backend_latency = None
+
+    def load(self):
+        """Загружает локальные интенты (без них работает только кэш)."""
+        if not self.intents_path:
+            return
+        try:
+            self.matcher.load(self.intents_path)
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning("Не удалось загрузить интенты %s: %s", self.intents_path, e)
+            return
+        logging.info("Загружено %s локальных интентов из %s.", len(self.matcher), self.intents_path)
+
+    async def respond(self, user_id, text):
+        """
+        Отвечает на сообщение пользователя
+        :param user_id: ID пользователя (ID сессии Dialogflow)
+        :param text: текст сообщения
+        :return: ответ или None, если Dialogflow недоступен
+        """
+        started = time.perf_counter()
+        phrase = normalize(text)
+        if phrase:
+            found = self.matcher.match(phrase, self.min_score)
+            if found is not None:
+                return self._answered("intent", random.choice(found[1]), started)
+        key = cache_key(text)
+        if key:
+            response = self.cache.get(key)
+            if response is not None:
+                return self._answered("cache", response, started)
+        response = await self.backend(user_id, text)
+        if response is None:
+            return None
+        elapsed = time.perf_counter() - started
+        self._backend_latency = elapsed if self._backend_latency is None else \
+            self._backend_latency + self.SMOOTHING * (elapsed - self._backend_latency)
+        if key and getattr(response, "cacheable", True):
+            self.cache.put(key, str(response))
+        return self._answered("dialogflow", response, started)
+
+    def _answered(self, source, response, started):
+        elapsed = time.perf_counter() - started
+        self.answers[source] += 1
+        if source != "dialogflow" and self._backend_latency is not None:
+            self.saved_seconds += max(0.0, self._backend_latency - elapsed)
+        metrics.registry.counter("bot_ai_answers_total", source=source).inc()
+        metrics.registry.histogram("bot_ai_answer_seconds", source=source).observe(elapsed)
+        return response
+
+    def stats(self):
+        total = sum(self.answers.values())
+        local = total - self.answers["dialogflow"]
+        return {
+            **self.answers,
+            "hit_rate": local / total if total else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "cache_size": len(self.cache),
+        }
+
+
+smalltalk = SmallTalk()
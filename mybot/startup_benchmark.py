@@ -0,0 +1,148 @@
+"""
+Бенчмарк холодного старта: время от запуска процесса бота до ответа на первое обновление.
+Каждый прогон запускает бота в отдельном процессе с поддельным Bot API, отправляет /start
+и ждет приветствия; бот сам останавливается после первого обработанного обновления
+и сообщает свои этапы запуска (импорт, готовность, первое обновление). Первый прогон
+создает базу данных, остальные - перезапуски с существующей базой.
+
+    python startup_benchmark.py --runs 5 --output before.json
+    python startup_benchmark.py --runs 5 --output after.json --compare before.json
+    python startup_benchmark.py --eager-ai  # со стеком ИИ, импортированным при запуске (для сравнения)
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from fake_bot_api import FakeBotAPI
+
+USER_ID = 1_000_000
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def child(base_url, eager_ai):
+    """Процесс бота: обрабатывает одно обновление, останавливается и выводит этапы запуска в stdout."""
+    # bot импортируется первым, чтобы этап imports включал python-telegram-bot
+    import bot
+    if eager_ai:
+        import ai_client  # noqa: F401
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    bot.METRICS_PORT = None
+
+    async def stop_after_first_update(update, context):
+        context.application.stop_running()
+
+    application = bot.build_application(token="0:benchmark", base_url=base_url)
+    application.add_handler(TypeHandler(Update, stop_after_first_update), group=2)
+    # Без долгого опроса: незавершенный getUpdates не должен забрать обновление следующего прогона
+    application.run_polling(timeout=0)
+    print(json.dumps(bot.startup))
+
+
+async def run_once(api, workdir, eager_ai, timeout):
+    """Один холодный старт. Возвращает этапы запуска бота и время до ответа (reply)."""
+    replied = asyncio.get_running_loop().create_future()
+
+    def on_request(method, params):
+        if method == "sendMessage" and int(params.get("chat_id", 0)) == USER_ID and not replied.done():
+            replied.set_result(time.perf_counter())
+
+    api.on_request = on_request
+    api.updates.put_nowait({
+        "update_id": int(time.time() * 1000),
+        "message": {"message_id": 1, "date": int(time.time()), "text": "/start",
+                    "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+                    "chat": {"id": USER_ID, "type": "private"},
+                    "from": {"id": USER_ID, "is_bot": False, "first_name": "Benchmark"}},
+    })
+    args = [sys.executable, os.path.abspath(__file__), "--child", api.base_url] + (["--eager-ai"] if eager_ai else [])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [HERE, os.environ.get("PYTHONPATH")])))
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(*args, cwd=workdir, env=env,
+                                                   stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        reply_at = await asyncio.wait_for(replied, timeout)
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        stdout, stderr = await process.communicate()
+        raise RuntimeError(f"бот не ответил за {timeout} с:\n{stderr.decode(errors='replace')}")
+    if process.returncode:
+        raise RuntimeError(f"бот завершился с кодом {process.returncode}:\n{stderr.decode(errors='replace')}")
+    phases = json.loads(stdout.decode().strip().splitlines()[-1])
+    phases["reply"] = round(reply_at - started, 4)
+    return phases
+
+
+async def benchmark(runs, eager_ai, timeout):
+    api = await FakeBotAPI().start()
+    workdir = tempfile.mkdtemp(prefix="startup_benchmark_")
+    intents = os.path.join(HERE, "smalltalk_intents.json")
+    if os.path.exists(intents):
+        shutil.copy(intents, workdir)
+    try:
+        results = []
+        for number in range(runs):
+            phases = await run_once(api, workdir, eager_ai, timeout)
+            print(f"Прогон {number + 1}: " + ", ".join(f"{phase} {seconds:.3f} с" for phase, seconds in phases.items()))
+            results.append(phases)
+    finally:
+        await api.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    # Первый прогон создает базу данных, поэтому медиана считается по перезапускам
+    restarts = results[1:] or results
+    return {
+        "runs": runs,
+        "eager_ai": eager_ai,
+        "first_run": results[0],
+        "median": {phase: round(statistics.median(run[phase] for run in restarts), 4) for phase in results[0]},
+    }
+
+
+def compare(current, previous, tolerance):
+    """Сравнивает медианы этапов; возвращает False, если какой-то этап стал медленнее больше чем на tolerance."""
+    ok = True
+    for phase, seconds in current["median"].items():
+        before = previous["median"].get(phase)
+        if not before:
+            continue
+        change = seconds / before - 1
+        worse = change > tolerance
+        ok = ok and not worse
+        print(f"{phase}: {before:.3f} -> {seconds:.3f} с ({change:+.0%}){' - ХУЖЕ' if worse else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старта бота с поддельным Bot API")
+    parser.add_argument("--runs", type=int, default=5, help="число запусков")
+    parser.add_argument("--eager-ai", action="store_true", help="импортировать стек ИИ при запуске бота")
+    parser.add_argument("--timeout", type=float, default=60.0, help="таймаут одного запуска в секундах")
+    parser.add_argument("--output", help="куда сохранить результат (JSON)")
+    parser.add_argument("--compare", help="результат прошлого прогона (JSON) для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="допустимое ухудшение (0.10 = 10%%)")
+    parser.add_argument("--child", metavar="BASE_URL", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.eager_ai)
+        return
+
+    result = asyncio.run(benchmark(args.runs, args.eager_ai, args.timeout))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        if not compare(result, previous, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()